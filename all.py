@@ -1,18 +1,192 @@
-import importlib
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+import traceback
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from pathlib import Path
 
-import drawsvg as dw
+import cache
+
+DIAGRAMS = ["combustion", "geometry", "hamiltonian", "ngon", "quaternions"]
+
+# the limits a budget file can set for each diagram, or for all of them under
+# "default", along with the manifest entry each one checks
+LIMITS = {"seconds": "seconds", "bytes": "bytes", "elements": "element_count"}
+
+TAG = re.compile(rb"<([A-Za-z][\w.:-]*)")
+
+
+def peak_memory() -> int:
+    # the most memory this process has ever had resident, in bytes
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def build(mod, func, out, stream, digits) -> tuple[float, int]:
+    # imported here so that a fully cached run never pays for drawsvg and numpy
+    from diagram import render
+
+    start = time.perf_counter()
+    render(mod, func, out, stream=stream, digits=digits)
+    return time.perf_counter() - start, peak_memory()
+
+
+def measure(out) -> dict:
+    # bytes is the size of the file, but the rest are of the SVG in it
+    raw = Path(out).read_bytes()
+    data = gzip.decompress(raw) if out.endswith(".svgz") else raw
+    tags = Counter(tag.decode() for tag in TAG.findall(data))
+    return {
+        "bytes": len(raw),
+        "element_count": sum(tags.values()),
+        "elements": dict(sorted(tags.items())),
+        "sha256": hashlib.sha256(data).hexdigest(),
+    }
+
+
+def over_budget(name, entry, budget) -> list[str]:
+    limits = {**budget.get("default", {}), **budget.get(name, {})}
+    problems = []
+    for limit, value in limits.items():
+        actual = entry.get(LIMITS[limit])
+        # diagrams restored from the cache may not have a render time
+        if actual is not None and actual > value:
+            if isinstance(actual, float):
+                actual = f"{actual:.3f}"
+            problems.append(f"{name}: {limit} is {actual}, over the limit of {value}")
+    return problems
 
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--force", action="store_true", help="ignore the cache")
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="write elements as they're drawn instead of all at the end",
+    )
+    parser.add_argument(
+        "--compact",
+        nargs="?",
+        type=int,
+        const=2,
+        metavar="DIGITS",
+        help="round numbers to DIGITS decimals (default: 2) and set shared "
+        "attributes once on a group",
+    )
+    parser.add_argument("--svgz", action="store_true", help="write gzipped SVGs")
+    parser.add_argument(
+        "--budget",
+        metavar="FILE",
+        help="JSON file of limits on each diagram's "
+        f"{', '.join(LIMITS)}, to fail if any are exceeded",
+    )
+    args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.compact is not None and args.compact < 0:
+        parser.error("--compact can't round to fewer than 0 digits")
+    budget = {}
+    if args.budget:
+        budget = json.loads(Path(args.budget).read_text())
+        for name, limits in budget.items():
+            if name != "default" and name not in DIAGRAMS:
+                parser.error(f"unknown diagram in budget: {name}")
+            unknown = set(limits) - set(LIMITS)
+            if unknown:
+                parser.error(f"unknown limits in budget: {', '.join(sorted(unknown))}")
+
     out = "out"
-    Path(out).mkdir(parents=True, exist_ok=True)
-    for name in ["combustion", "geometry", "hamiltonian", "ngon", "quaternions"]:
-        d = getattr(importlib.import_module(name), "draw")()
-        if isinstance(d, dw.Drawing):
-            d.save_svg(f"{out}/{name}.svg")
+    flags = ["stream"] if args.stream else []
+    if args.compact is not None:
+        flags.append(f"compact={args.compact}")
+    suffix = ".svgz" if args.svgz else ".svg"
+    manifest_path = Path(out) / "manifest.json"
+    try:
+        previous = json.loads(manifest_path.read_text())
+    except (OSError, ValueError):
+        previous = {}
+
+    keys = {}
+    jobs = {}
+    for name in DIAGRAMS:
+        job = (name, "draw", f"{out}/{name}{suffix}", args.stream, args.compact)
+        keys[name] = cache.key(name, "draw", *flags)
+        if args.force or not cache.restore(keys[name], job[2]):
+            jobs[name] = job
+
+    failed = []
+    metrics = {}
+
+    def done(name, e):
+        if e is None:
+            cache.store(keys[name], jobs[name][2])
         else:
-            raise TypeError(f"Expected Drawing, got {type(d)}")
+            failed.append(name)
+            print(f"{name}: failed", file=sys.stderr)
+            traceback.print_exception(type(e), e, e.__traceback__)
+
+    if jobs:
+        # a one-worker pool per diagram, so that its peak memory is its own and
+        # a worker that dies only fails its own diagram, with BrokenProcessPool
+        queue = list(jobs.items())
+        running = {}
+        while queue or running:
+            while queue and len(running) < args.jobs:
+                name, job = queue.pop(0)
+                pool = ProcessPoolExecutor(max_workers=1)
+                running[pool.submit(build, *job)] = name, pool
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name, pool = running.pop(future)
+                pool.shutdown()
+                try:
+                    metrics[name] = future.result()
+                except Exception as e:
+                    done(name, e)
+                else:
+                    done(name, None)
+
+    hits = len(DIAGRAMS) - len(jobs)
+    print(f"cache: {hits} hits, {len(jobs)} misses")
+
+    manifest = {}
+    problems = []
+    for name in DIAGRAMS:
+        if name in failed:
+            continue
+        file = f"{out}/{name}{suffix}"
+        entry = {"file": file, **measure(file)}
+        if name in metrics:
+            entry["seconds"], entry["peak_memory"] = metrics[name]
+        else:
+            # restored from the cache, so the last render's numbers still hold
+            # as long as it was of the same output
+            last = previous.get(name, {})
+            same = last.get("sha256") == entry["sha256"]
+            entry["seconds"] = last.get("seconds") if same else None
+            entry["peak_memory"] = last.get("peak_memory") if same else None
+        entry["cached"] = name not in jobs
+        manifest[name] = entry
+        problems += over_budget(name, entry, budget)
+
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    manifest_path.write_text(json.dumps(manifest, indent=2) + "\n")
+
+    if failed:
+        sys.exit(f"{len(failed)} of {len(jobs)} diagrams failed: {', '.join(failed)}")
+    if problems:
+        print("\n".join(problems), file=sys.stderr)
+        sys.exit(f"{len(problems)} limits exceeded")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,7 @@
+import timeit
+
+
+def best(f, *, number=1, repeat=5) -> float:
+    # seconds per call, from the fastest of several runs of number calls each,
+    # since anything slower than that was slowed down by something else
+    return min(timeit.repeat(f, number=number, repeat=repeat)) / number
@@ -0,0 +1,127 @@
+# Times every diagram and the helpers they share, and compares the results with
+# an earlier run. Run from the repository root:
+#
+#     uv run -m benchmarks run -o baseline.json
+#     (upgrade a library, refactor something, ...)
+#     uv run -m benchmarks run -o results.json
+#     uv run -m benchmarks compare baseline.json results.json
+
+import argparse
+import importlib
+import json
+import platform
+import subprocess
+import sys
+from pathlib import Path
+
+import cache
+
+SUITES = ["micro", "diagrams", "scaled"]
+
+
+def metadata() -> dict:
+    commit = subprocess.run(
+        ["git", "rev-parse", "HEAD"],
+        cwd=cache.ROOT,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    ).stdout.strip()
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "libraries": {lib: cache.installed(lib) for lib in cache.LIBRARIES},
+        "commit": commit or None,
+    }
+
+
+def run(args):
+    results = {}
+    for name in args.suites or SUITES:
+        print(f"running {name}", file=sys.stderr)
+        suite = importlib.import_module(f"benchmarks.{name}")
+        results.update(suite.run(args.repeat))
+    for name, seconds in results.items():
+        print(f"{name:<40} {format_time(seconds):>10}")
+    if args.output:
+        report = {"metadata": metadata(), "results": results}
+        Path(args.output).write_text(json.dumps(report, indent=2) + "\n")
+
+
+def format_time(seconds) -> str:
+    for unit, scale in [("s", 1), ("ms", 1e-3), ("µs", 1e-6)]:
+        if seconds >= scale:
+            return f"{seconds / scale:.2f}{unit}"
+    return f"{seconds / 1e-9:.0f}ns"
+
+
+def compare(args) -> int:
+    # the number of benchmarks that got slower than the baseline by more than
+    # the threshold, as a fraction of the baseline's time
+    old = json.loads(Path(args.baseline).read_text())["results"]
+    new = json.loads(Path(args.results).read_text())["results"]
+    regressions = 0
+    print(f"{'benchmark':<40} {'baseline':>10} {'results':>10} {'change':>8}")
+    for name in sorted(old.keys() | new.keys()):
+        if name not in new:
+            print(f"{name:<40} {format_time(old[name]):>10} {'missing':>10}")
+            continue
+        if name not in old:
+            print(f"{name:<40} {'new':>10} {format_time(new[name]):>10}")
+            continue
+        change = new[name] / old[name] - 1
+        flag = ""
+        if change > args.threshold:
+            regressions += 1
+            flag = "  slower"
+        print(
+            f"{name:<40} {format_time(old[name]):>10} {format_time(new[name]):>10}"
+            f" {change:>+8.1%}{flag}"
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("run", help="run the benchmarks")
+    p.add_argument(
+        "suites", nargs="*", help=f"any of {', '.join(SUITES)} (default: all)"
+    )
+    p.add_argument("-o", "--output", help="JSON file to write the results to")
+    p.add_argument("-r", "--repeat", type=int, default=3)
+
+    p = commands.add_parser("compare", help="compare results with a baseline")
+    p.add_argument("baseline")
+    p.add_argument("results")
+    p.add_argument(
+        "-t",
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="how much slower counts as a regression (default: 0.1, for 10%%)",
+    )
+
+    commands.add_parser("vectors", help="compare Vec2/Vec3 with NumPy arrays")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        if args.repeat < 1:
+            parser.error("--repeat must be at least 1")
+        unknown = set(args.suites) - set(SUITES)
+        if unknown:
+            parser.error(f"unknown suites: {', '.join(sorted(unknown))}")
+        run(args)
+    elif args.command == "compare":
+        regressions = compare(args)
+        if regressions:
+            sys.exit(f"{regressions} benchmarks regressed")
+    else:
+        from benchmarks.micro import vectors
+
+        vectors()
+
+
+if __name__ == "__main__":
+    main()
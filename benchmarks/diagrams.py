@@ -0,0 +1,55 @@
+# How long each diagram takes to import, draw and save. Every run happens in
+# a fresh interpreter, so that imports aren't already cached, with its own
+# empty layout cache, so that layouts are really computed.
+
+import importlib
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import cache
+from all import DIAGRAMS
+
+
+def phases(mod: str) -> dict[str, float]:
+    with tempfile.TemporaryDirectory() as tmp:
+        cache.LAYOUTS = Path(tmp) / "layout"
+
+        start = time.perf_counter()
+        module = importlib.import_module(mod)
+        imported = time.perf_counter()
+        d = module.draw()
+        drawn = time.perf_counter()
+        d.save_svg(Path(tmp) / f"{mod}.svg")
+        saved = time.perf_counter()
+
+    return {
+        "import": imported - start,
+        "draw": drawn - imported,
+        "save": saved - drawn,
+    }
+
+
+def run(repeat) -> dict[str, float]:
+    results = {}
+    for mod in DIAGRAMS:
+        runs = []
+        for _ in range(repeat):
+            out = subprocess.run(
+                [sys.executable, "-m", "benchmarks.diagrams", mod],
+                cwd=cache.ROOT,
+                stdout=subprocess.PIPE,
+                check=True,
+                text=True,
+            ).stdout
+            runs.append(json.loads(out))
+        for phase in runs[0]:
+            results[f"diagram/{mod}/{phase}"] = min(r[phase] for r in runs)
+    return results
+
+
+if __name__ == "__main__":
+    print(json.dumps(phases(sys.argv[1])))
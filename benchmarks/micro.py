@@ -0,0 +1,65 @@
+# The per-operation cost of diagram's vector helpers, and of the NumPy arrays
+# they replaced. Run from the repository root to compare the two:
+#
+#     uv run -m benchmarks vectors
+
+import numpy as np
+from numpy.linalg import norm
+
+from benchmarks import best
+from combustion import Rotation
+from diagram import normalize, rot90, vec2, vec3
+
+
+def np_normalize(v):
+    return v / norm(v)
+
+
+def np_rot90(v):
+    x, y = v
+    return np.array([-y, x])
+
+
+def cases():
+    a2, b2 = vec2(3.0, 4.0), vec2(-1.5, 2.5)
+    a3, b3 = vec3(1.0, 2.0, 3.0), vec3(-2.0, 0.5, 1.5)
+    n2, m2 = np.array([3.0, 4.0]), np.array([-1.5, 2.5])
+    n3, m3 = np.array([1.0, 2.0, 3.0]), np.array([-2.0, 0.5, 1.5])
+    return [
+        ("vec2", lambda: vec2(3.0, 4.0), lambda: np.array([3.0, 4.0])),
+        ("vec3", lambda: vec3(1.0, 2.0, 3.0), lambda: np.array([1.0, 2.0, 3.0])),
+        ("add", lambda: a2 + b2, lambda: n2 + m2),
+        ("sub", lambda: a3 - b3, lambda: n3 - m3),
+        ("scale", lambda: a2 * 2.5, lambda: n2 * 2.5),
+        ("divide", lambda: a3 / 2.5, lambda: n3 / 2.5),
+        ("unpack", lambda: (*a2,), lambda: (*n2,)),
+        ("dot", lambda: a3.dot(b3), lambda: np.dot(n3, m3)),
+        ("cross", lambda: a3.cross(b3), lambda: np.cross(n3, m3)),
+        ("normalize", lambda: normalize(a2), lambda: np_normalize(n2)),
+        ("rot90", lambda: rot90(a2), lambda: np_rot90(n2)),
+    ]
+
+
+def run(repeat) -> dict[str, float]:
+    number = 20000
+    results = {}
+    for name, fast, _ in cases():
+        results[f"micro/{name}"] = best(fast, number=number, repeat=repeat)
+
+    r = Rotation(e=normalize(vec3(1.0, 2.0, 2.0)), theta=0.5)
+    v = vec3(0.5, -1.0, 2.0)
+    results["micro/rotate"] = best(lambda: r.rotate(v), number=number, repeat=repeat)
+    points = np.random.default_rng(0).normal(size=(10000, 3))
+    results["micro/rotate_many"] = best(
+        lambda: r.rotate_many(points), number=100, repeat=repeat
+    )
+    return results
+
+
+def vectors():
+    number = 20000
+    print(f"{'operation':<10} {'Vec':>10} {'numpy':>10} {'speedup':>8}")
+    for name, fast, slow in cases():
+        t = best(fast, number=number)
+        u = best(slow, number=number)
+        print(f"{name:<10} {t * 1e9:>8.0f}ns {u * 1e9:>8.0f}ns {u / t:>7.1f}x")
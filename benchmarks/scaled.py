@@ -0,0 +1,133 @@
+# Each diagram's code on inputs much bigger than the diagrams themselves use,
+# generated from fixed seeds so that every run draws the same thing.
+
+import contextlib
+import itertools
+import random
+import tempfile
+from pathlib import Path
+
+import drawsvg as dw
+import networkx as nx
+import numpy as np
+
+import cache
+import combustion
+import geometry
+import hamiltonian
+import layout
+import ngon
+import quaternions
+from benchmarks import best
+from diagram import vec2, vec3
+
+
+def molecule(n) -> combustion.Molecule:
+    # atoms scattered through a ball, each bonded to its two nearest neighbors
+    rng = np.random.default_rng(0)
+    points = rng.normal(size=(n, 3))
+    points *= (n / 8) ** (1 / 3) / np.linalg.norm(points, axis=1, keepdims=True)
+    points *= rng.random((n, 1)) ** (1 / 3)
+    bonds = set()
+    for k, p in enumerate(points):
+        distance = np.linalg.norm(points - p, axis=1)
+        distance[k] = np.inf
+        bonds.update(tuple(sorted((k, int(j)))) for j in np.argsort(distance)[:2])
+    bonds = sorted(bonds)
+    return combustion.Molecule(
+        name="random",
+        formula="X",
+        atoms=[("HCO"[k % 3], vec3(*p)) for k, p in enumerate(points.tolist())],
+        single=[b for k, b in enumerate(bonds) if k % 7],
+        double=[b for k, b in enumerate(bonds) if not k % 7],
+    )
+
+
+def graph(n) -> nx.Graph:
+    # a random graph with a Hamiltonian cycle hidden among its other edges
+    rng = random.Random(0)
+    nodes = list(range(n))
+    rng.shuffle(nodes)
+    g = nx.Graph()
+    g.add_nodes_from(range(n))
+    g.add_edges_from(itertools.pairwise(nodes + nodes[:1]))
+    g.add_edges_from(rng.sample(range(n), 2) for _ in range(n))
+    return g
+
+
+def construction(n) -> geometry.Geometry:
+    rng = random.Random(0)
+    g = geometry.Geometry()
+    points = [g.point(f"p{k}") for k in range(n)]
+    for _ in range(n // 4):
+        p, q, r = rng.sample(points, 3)
+        g.segment(p, q)
+        g.angle(p, q, r)
+        g.triangle(p, q, r)
+    return g
+
+
+@contextlib.contextmanager
+def uncached_layouts():
+    # layouts are computed every time instead of coming from the cache, which
+    # is put back even if a benchmark fails
+    saved = cache.LAYOUTS, cache.LAYOUT_LIMIT
+    with tempfile.TemporaryDirectory() as tmp:
+        cache.LAYOUTS = Path(tmp)
+        cache.LAYOUT_LIMIT = 0
+        try:
+            yield
+        finally:
+            cache.LAYOUTS, cache.LAYOUT_LIMIT = saved
+
+
+def run(repeat) -> dict[str, float]:
+    results = {}
+
+    def bench(name, f):
+        results[f"scaled/{name}"] = best(f, repeat=repeat)
+
+    with uncached_layouts():
+        m = molecule(500)
+        bench(
+            "combustion/500_atoms",
+            lambda: combustion.reaction(
+                title="", reactants=[m, m], products=[m], seed=0
+            ).as_svg(),
+        )
+
+        g = graph(300)
+        bench(
+            "hamiltonian/300_nodes",
+            lambda: hamiltonian.hamiltonian_graph(g, seed=0, engine="barnes_hut"),
+        )
+        g = graph(2000)
+        cycle = list(g)
+        bench(
+            "layout/barnes_hut_2000_nodes",
+            lambda: layout.barnes_hut(g, cycle, scale=150, center=(200, 200), seed=0),
+        )
+
+        g = construction(200)
+        bench("geometry/200_points", lambda: geometry.euclidean(g, seed=0).as_svg())
+        bench("geometry/score_200_seeds", lambda: geometry.score_layouts(g, range(200)))
+
+    def penrose():
+        ngon.penrose_data.cache_clear()
+        ngon.penrose(dw.Path(), center=vec2(0, 0), radius=150, n_sides=5000)
+
+    bench("ngon/5000_sides", penrose)
+
+    perms = np.array(list(itertools.permutations(range(5))))
+    bench(
+        "quaternions/s5_runs",
+        lambda: quaternions.cayley_table(perms, texify=str, mode="runs").as_svg(),
+    )
+    bench(
+        "quaternions/s5_image",
+        lambda: quaternions.cayley_table(perms, texify=str, mode="image").as_svg(),
+    )
+    perms = np.array(list(itertools.permutations(range(6))))
+    bench("quaternions/s6_table", lambda: quaternions.multiplication_table(perms))
+
+    return results
@@ -0,0 +1,165 @@
+import ast
+import contextlib
+import filecmp
+import functools
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+ROOT = Path(__file__).parent
+CACHE = ROOT / ".cache" / "render"
+LAYOUTS = ROOT / ".cache" / "layout"
+
+# the least recently used layouts are deleted once there are more than this
+# many bytes of them
+LAYOUT_LIMIT = 256 * 2**20
+
+# third-party libraries whose upgrades can change the rendered output
+LIBRARIES = ["drawsvg", "networkx", "numpy", "sympy"]
+
+
+def source(mod: str) -> Path:
+    return ROOT / f"{mod}.py"
+
+
+@functools.cache
+def imported(path: Path, mtime_ns: int) -> frozenset[str]:
+    # the top-level names of every module the file imports, parsed once per
+    # version of it, since every cache key needs most of the same files
+    names = set()
+    for node in ast.walk(ast.parse(path.read_bytes())):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names.add(node.module.split(".")[0])
+    return frozenset(names)
+
+
+def imports(mod: str) -> list[str]:
+    path = source(mod)
+    names = imported(path, path.stat().st_mtime_ns)
+    return sorted(name for name in names - {mod} if source(name).is_file())
+
+
+def dependencies(mod: str) -> list[str]:
+    # the module itself and every local module it transitively imports,
+    # dependencies first
+    seen = set()
+    order = []
+
+    def visit(m):
+        if m not in seen:
+            seen.add(m)
+            for n in imports(m):
+                visit(n)
+            order.append(m)
+
+    visit(mod)
+    return order
+
+
+@functools.cache
+def installed(lib: str) -> str:
+    # importlib.metadata is slow to import, and only needed for cache keys
+    from importlib.metadata import PackageNotFoundError, version
+
+    try:
+        return version(lib)
+    except PackageNotFoundError:
+        return "missing"
+
+
+def key(mod: str, func: str, *flags: str) -> str:
+    h = hashlib.sha256()
+    h.update(f"{mod}.{func}\n".encode())
+    for flag in flags:
+        h.update(f"--{flag}\n".encode())
+    for lib in LIBRARIES:
+        h.update(f"{lib}=={installed(lib)}\n".encode())
+    for m in dependencies(mod):
+        h.update(f"{m}\n".encode())
+        h.update(source(m).read_bytes())
+    return h.hexdigest()
+
+
+def entry(key: str, out) -> Path:
+    return CACHE / f"{key}{Path(out).suffix}"
+
+
+def restore(key: str, out) -> bool:
+    cached = entry(key, out)
+    if not cached.is_file():
+        return False
+    out = Path(out)
+    # leave an up-to-date output alone so that its mtime doesn't change
+    if not (out.is_file() and filecmp.cmp(cached, out, shallow=False)):
+        out.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(cached, out)
+    return True
+
+
+def store(key: str, out):
+    cached = entry(key, out)
+    cached.parent.mkdir(parents=True, exist_ok=True)
+    tmp = cached.with_name(f"{cached.name}.{os.getpid()}.tmp")
+    shutil.copyfile(out, tmp)
+    os.replace(tmp, cached)
+
+
+def evict(directory: Path, limit: int):
+    # other processes may be writing, replacing and evicting entries meanwhile,
+    # so files can disappear at any point, and the ones they're still writing
+    # aren't entries yet
+    entries = []
+    for e in os.scandir(directory):
+        if e.name.endswith(".tmp"):
+            continue
+        try:
+            s = e.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((s.st_mtime_ns, s.st_size, e.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        Path(path).unlink(missing_ok=True)
+        total -= size
+
+
+def layout(kind: str, inputs, compute, *, sources=()) -> dict:
+    # the arrays that compute() returns, as saved by an earlier call with the
+    # same kind, inputs and source files if there was one; the inputs must be
+    # serializable as JSON, listed in an order that affects the result
+    import numpy as np
+
+    h = hashlib.sha256()
+    h.update(json.dumps([kind, inputs], default=repr).encode())
+    for lib in LIBRARIES:
+        h.update(f"{lib}=={installed(lib)}\n".encode())
+    for m in sources:
+        h.update(f"{m}\n".encode())
+        h.update(source(m).read_bytes())
+    path = LAYOUTS / f"{h.hexdigest()}.npz"
+
+    try:
+        with np.load(path) as f:
+            arrays = dict(f)
+    except (OSError, ValueError):
+        pass  # not cached, or evicted by another process in the meantime
+    else:
+        # the modification time is what eviction goes by
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(path)
+        return arrays
+
+    arrays = compute()
+    LAYOUTS.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, path)
+    evict(LAYOUTS, LAYOUT_LIMIT)
+    return arrays
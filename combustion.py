@@ -1,12 +1,28 @@
 import random
 from dataclasses import dataclass
-from math import cos, radians, sin, sqrt, tau
+from functools import cached_property
+from math import cos, hypot, radians, sin, sqrt, tau
 
 import drawsvg as dw
-from numpy import cross, dot
-from numpy.linalg import norm
 
-from diagram import Vec3, normalize, rgb, rot90, vec2, vec3
+from diagram import (
+    Grid,
+    Vec3,
+    drawing,
+    lazy,
+    normalize,
+    normalize_many,
+    phase,
+    rgb,
+    rot90_many,
+    segment_distance,
+    segment_distances,
+    segments_distance,
+    vec2,
+    vec3,
+)
+
+np = lazy("numpy")
 
 
 # https://en.wikipedia.org/wiki/Axis%E2%80%93angle_representation
@@ -18,22 +34,110 @@ class Rotation:
     def rotate(self, v: Vec3) -> Vec3:
         return (
             cos(self.theta) * v
-            + sin(self.theta) * cross(self.e, v)
-            + (1 - cos(self.theta)) * dot(self.e, v) * self.e
+            + sin(self.theta) * self.e.cross(v)
+            + (1 - cos(self.theta)) * self.e.dot(v) * self.e
         )
 
+    # the same rotation as a matrix, to rotate the rows of an (N, 3) array at once
+    @cached_property
+    def matrix(self):
+        x, y, z = self.e
+        c = cos(self.theta)
+        s = sin(self.theta)
+        k = np.array([[0, -z, y], [z, 0, -x], [-y, x, 0]])
+        return c * np.eye(3) + s * k + (1 - c) * np.outer(self.e, self.e)
+
+    def rotate_many(self, points):
+        return points @ self.matrix.T
+
 
 def random_rotation() -> Rotation:
     def random_in_cube():
         return vec3(random.uniform(-1, 1), random.uniform(-1, 1), random.uniform(-1, 1))
 
     v = random_in_cube()
-    while norm(v) > 1:
+    while v.norm() > 1:
         v = random_in_cube()
 
     return Rotation(e=normalize(v), theta=random.uniform(0, tau))
 
 
+def circle_intersection(c1, r1, c2, r2) -> list:
+    # the points where two circles cross, if they do
+    dx, dy = c2[0] - c1[0], c2[1] - c1[1]
+    dist2 = dx * dx + dy * dy
+    if not (0 < dist2 <= (r1 + r2) ** 2 and dist2 >= (r1 - r2) ** 2):
+        return []
+    dist = sqrt(dist2)
+    along = (r1 * r1 - r2 * r2 + dist * dist) / (2 * dist)
+    across = sqrt(max(r1 * r1 - along * along, 0))
+    ux, uy = dx / dist, dy / dist
+    x, y = c1[0] + ux * along, c1[1] + uy * along
+    return [(x + uy * across, y - ux * across), (x - uy * across, y + ux * across)]
+
+
+def capsule_covered(a, b, w, centers, radii, eps=1e-6) -> bool:
+    # whether the union of the discs covers every point within w of the segment
+    # from a to b (a disc when a == b). Any uncovered patch would have a corner
+    # where two circles cross or one crosses the capsule's outline, or would
+    # contain a whole piece of the outline, so it's enough to check that all of
+    # those points are strictly inside some disc.
+    discs = [(x, y, r) for (x, y), r in zip(centers, radii)]
+    if not discs:
+        return False
+    ax, ay = a
+    bx, by = b
+
+    def covered(px, py) -> bool:
+        return any((px - x) ** 2 + (py - y) ** 2 < (r - eps) ** 2 for x, y, r in discs)
+
+    # a single disc is enough whenever it holds both ends
+    for x, y, r in discs:
+        if hypot(x - ax, y - ay) + w <= r and hypot(x - bx, y - by) + w <= r:
+            return True
+
+    length = hypot(bx - ax, by - ay)
+    tx, ty = ((bx - ax) / length, (by - ay) / length) if length > 0 else (1.0, 0.0)
+    nx, ny = -ty * w, tx * w
+
+    # checking a few points on the outline first rules out most visible shapes
+    if length > 0:
+        outline = [(ax + nx, ay + ny), (ax - nx, ay - ny)]
+        outline += [(bx + nx, by + ny), (bx - nx, by - ny)]
+    else:
+        outline = [(ax + tx * w, ay + ty * w)]
+    if not all(covered(*p) for p in outline):
+        return False
+
+    for ex, ey, sign in [(ax, ay, -1), (bx, by, 1)][: 2 if length > 0 else 1]:
+        for x, y, r in discs:
+            for px, py in circle_intersection((ex, ey), w, (x, y), r):
+                if length > 0 and sign * ((px - ex) * tx + (py - ey) * ty) < 0:
+                    continue
+                if not covered(px, py):
+                    return False
+
+    if length > 0:
+        for sx, sy in [(ax + nx, ay + ny), (ax - nx, ay - ny)]:
+            for x, y, r in discs:
+                fx, fy = sx - x, sy - y
+                half = fx * tx + fy * ty
+                disc = half * half - (fx * fx + fy * fy - r * r)
+                if disc < 0:
+                    continue
+                root = sqrt(disc)
+                for s in [-half - root, -half + root]:
+                    if 0 <= s <= length and not covered(sx + s * tx, sy + s * ty):
+                        return False
+
+    for i, (x1, y1, r1) in enumerate(discs):
+        for x2, y2, r2 in discs[i + 1 :]:
+            for p in circle_intersection((x1, y1), r1, (x2, y2), r2):
+                if segment_distance(p, (ax, ay), (bx, by)) < w and not covered(*p):
+                    return False
+    return True
+
+
 @dataclass(kw_only=True)
 class Molecule:
     name: str
@@ -43,10 +147,18 @@ class Molecule:
     double: list[tuple[int, int]]
 
 
-def reaction(*, title: str, reactants: list[Molecule], products: list[Molecule], seed):
+def reaction(
+    *,
+    title: str,
+    reactants: list[Molecule],
+    products: list[Molecule],
+    seed,
+    merge_bonds=True,
+    cull=True,
+):
     width = 1248
     height = 702
-    d = dw.Drawing(width, height)
+    d = drawing(width, height)
 
     gray = rgb(0.5, 0.5, 0.5)
     turquoise = rgb(0.1, 0.7, 0.6)
@@ -54,6 +166,8 @@ def reaction(*, title: str, reactants: list[Molecule], products: list[Molecule],
     atom_colors = {"H": gray, "C": "black", "O": "red"}
 
     atom_radius = 25
+    # bounds the cost of checking each atom against the pending bonds
+    max_batch = 500
     bond_length = 80
 
     atom_radii = {"H": 0.75 * atom_radius, "C": atom_radius, "O": atom_radius}
@@ -68,152 +182,256 @@ def reaction(*, title: str, reactants: list[Molecule], products: list[Molecule],
 
     random.seed(seed)
 
-    shadows = dw.Group()
-    molecules = dw.Group()
-    labels = dw.Group()
+    shadows = d.group()
+    molecules = d.group()
+    labels = d.group()
+
+    # every molecule adds its atoms and bonds to one scene, which is drawn back
+    # to front at the end so that molecules in front hide the ones behind them
+    elements = []
+    locs = []
+    centers = []
+    bonds = []
+    doubles = []
 
     def molecule(mol: Molecule, center):
         count = len(mol.atoms)
+        first = len(elements)
 
         rotation = random_rotation()
-        locs = [rotation.rotate(v) for _, v in mol.atoms]
-        order = sorted(range(count), key=lambda i: locs[i][2])
-        single = [[] for _ in range(count)]
-        double = [[] for _ in range(count)]
-
-        for i, j in mol.single:
-            single[i].append(j)
-            single[j].append(i)
-
-        for i, j in mol.double:
-            double[i].append(j)
-            double[j].append(i)
-
-        done = [False for _ in range(count)]
-
-        for i in order:
-            a, _ = mol.atoms[i]
-            p = locs[i]
-
-            shadows.append(
-                dw.Ellipse(
-                    *(center + vec2(p[0], p[2] / 2 + 1.5) * bond_length),
-                    2 * atom_radii[a],
-                    atom_radii[a],
-                    fill=rgb(0.95, 0.95, 0.95),
-                    stroke="none",
-                )
-            )
+        elements.extend(a for a, _ in mol.atoms)
+        with phase("rotation"):
+            points = np.array([v for _, v in mol.atoms]).reshape(-1, 3)
+            locs.append(rotation.rotate_many(points))
+        centers.append(np.tile(center, (count, 1)))
+        bonds.append(
+            np.array(mol.single + mol.double, dtype=int).reshape(-1, 2) + first
+        )
+        doubles.append(np.arange(len(mol.single) + len(mol.double)) >= len(mol.single))
 
-            molecules.append(
-                dw.Circle(
-                    *(center + vec2(p[0], p[1]) * bond_length),
-                    atom_radii[a],
-                    fill="white",
-                    stroke=atom_colors[a],
-                    stroke_width=3,
-                )
+        labels.append(
+            dw.Text(
+                f"{mol.name} ({mol.formula})",
+                "22.5px",
+                *(center + vec2(0, bond_length * 0.75)),
+                center=True,
+                font_family=font_family,
+                stroke="white",
+                stroke_width=5,
+                paint_order="stroke",
             )
+        )
 
-            for j in single[i]:
-                if done[j]:
-                    continue
-
-                b, _ = mol.atoms[j]
-                q = locs[j]
-
-                v = q - p
-                t = normalize(v)
-
-                s = p * bond_length + t * atom_radii[a]
-                e = q * bond_length - t * atom_radii[b]
-
-                molecules.append(
-                    dw.Line(
-                        *(center + vec2(s[0], s[1])),
-                        *(center + vec2(e[0], e[1])),
-                        stroke=turquoise,
-                        stroke_width=10,
-                        stroke_linecap="round",
-                    )
+    def scene():
+        count = len(elements)
+        loc = np.concatenate(locs)
+        center = np.concatenate(centers)
+        with phase("z-sort"):
+            order = np.argsort(loc[:, 2], kind="stable")
+            rank = np.empty(count, dtype=int)
+            rank[order] = np.arange(count)
+
+            # each bond is drawn right after whichever of its atoms is further
+            # back, single bonds first, each kind in the order its molecule
+            # lists them
+            pairs = np.concatenate(bonds)
+            double_ = np.concatenate(doubles)
+            back = rank[pairs[:, 0]] < rank[pairs[:, 1]]
+            i = np.where(back, pairs[:, 0], pairs[:, 1])
+            j = np.where(back, pairs[:, 1], pairs[:, 0])
+            by = np.lexsort((double_, rank[i]))
+            i, j, double_ = i[by], j[by], double_[by]
+
+        radii = np.array([atom_radii[a] for a in elements])
+        v = loc[j] - loc[i]
+        t = normalize_many(v)
+        s = loc[i] * bond_length + t * radii[i, None]
+        e = loc[j] * bond_length - t * radii[j, None]
+        # offset of the two strokes of a double bond from its center line
+        u = np.zeros((len(pairs), 2))
+        u[double_] = rot90_many(normalize_many(v[double_, :2])) * atom_radius / 4
+        starts = (s[:, :2] + center[i]).tolist()
+        ends = (e[:, :2] + center[i]).tolist()
+        shifts = u.tolist()
+        drawn_after = i.tolist()
+
+        atoms = (loc[:, :2] * bond_length + center).tolist()
+        floor = np.stack([loc[:, 0], loc[:, 2] / 2 + 1.5], axis=1)
+        floors = (floor * bond_length + center).tolist()
+        # how far each atom's circle reaches, including half of its outline
+        reach = (radii + 3 / 2).tolist()
+
+        strokes = []
+        for (sx, sy), (ex, ey), (ux, uy), double in zip(
+            starts, ends, shifts, double_.tolist()
+        ):
+            if double:
+                strokes.append(
+                    [
+                        ((sx - ux, sy - uy), (ex - ux, ey - uy)),
+                        ((sx + ux, sy + uy), (ex + ux, ey + uy)),
+                    ]
                 )
-                molecules.append(
-                    dw.Line(
-                        *(center + vec2(s[0], s[1])),
-                        *(center + vec2(e[0], e[1])),
-                        stroke="white",
-                        stroke_width=4,
-                        stroke_linecap="round",
-                    )
+            else:
+                strokes.append([((sx, sy), (ex, ey))])
+
+        visible = [True] * count
+        shadowed = [True] * count
+        if cull:
+            with phase("culling"):
+                # going from front to back, anything that the circles already in
+                # front of it cover completely would never be seen, so leave it out
+                def hidden(grid, spots, sizes, a, b, w) -> bool:
+                    x0, x1 = sorted([a[0], b[0]])
+                    y0, y1 = sorted([a[1], b[1]])
+                    found = grid.query(x0 - w, y0 - w, x1 + w, y1 + w)
+                    if not found:
+                        return False
+                    c = spots[found]
+                    r = sizes[found]
+                    gap = segment_distances(c, a, b) - r
+                    near = np.argsort(gap, kind="stable")[: np.count_nonzero(gap < w)]
+                    c, r = c[near], r[near]
+                    # the nearest few circles almost always cover it if anything
+                    # does, and checking more of them gets expensive quickly
+                    return capsule_covered(a, b, w, c[:12].tolist(), r[:12].tolist())
+
+                def add(grid, k, p, r):
+                    grid.insert(k, p[0] - r, p[1] - r, p[0] + r, p[1] + r)
+
+                spots = np.array(atoms)
+                sizes = np.array(reach)
+                grid = Grid(2 * max(reach))
+                k = len(drawn_after)
+                for m in reversed(order.tolist()):
+                    while k > 0 and drawn_after[k - 1] == m:
+                        k -= 1
+                        strokes[k] = [
+                            (p, q)
+                            for p, q in strokes[k]
+                            if not hidden(grid, spots, sizes, p, q, 5)
+                        ]
+                    p = atoms[m]
+                    if hidden(grid, spots, sizes, p, p, reach[m]):
+                        visible[m] = False
+                    else:
+                        add(grid, m, p, reach[m])
+
+                # the shadows all look the same so their order doesn't matter, and
+                # stretching them vertically turns them into circles
+                spots = np.array(floors) * [1, 2]
+                sizes = 2 * radii
+                grid = Grid(2 * sizes.max())
+                for m in reversed(order.tolist()):
+                    p, r = spots[m].tolist(), sizes[m]
+                    if hidden(grid, spots, sizes, p, p, r):
+                        shadowed[m] = False
+                    else:
+                        add(grid, m, p, r)
+
+        # with merge_bonds, bond segments are collected and drawn as one path per
+        # stroke style, until an atom or another bond that overlaps one of them
+        # has to go on top
+        batch = []
+        pending = Grid(40)
+
+        def flush():
+            for stroke, stroke_width in [(turquoise, 10), ("white", 4)]:
+                path = dw.Path(
+                    fill="none",
+                    stroke=stroke,
+                    stroke_width=stroke_width,
+                    stroke_linecap="round",
                 )
+                for s, e in batch:
+                    path.M(*s).L(*e)
+                molecules.append(path)
+            batch.clear()
+            pending.cells.clear()
+
+        def covers(p, r) -> bool:
+            # the atom's outline and the bonds' outer stroke are 3 and 10 wide
+            return any(segment_distance(p, s, e) < r + 3 / 2 + 5 for s, e in batch)
+
+        def box(s, e):
+            # around the bond's outer stroke, which is 10 wide
+            return (
+                min(s[0], e[0]) - 5,
+                min(s[1], e[1]) - 5,
+                max(s[0], e[0]) + 5,
+                max(s[1], e[1]) + 5,
+            )
 
-            for j in double[i]:
-                if done[j]:
-                    continue
-
-                b, _ = mol.atoms[j]
-                q = locs[j]
-
-                v = q - p
-                t = normalize(v)
-
-                s = p * bond_length + t * atom_radii[a]
-                e = q * bond_length - t * atom_radii[b]
-
-                u = rot90(normalize(vec2(v[0], v[1]))) * atom_radius / 4
-
-                molecules.append(
-                    dw.Line(
-                        *(center + vec2(s[0], s[1]) - u),
-                        *(center + vec2(e[0], e[1]) - u),
-                        stroke=turquoise,
-                        stroke_width=10,
-                        stroke_linecap="round",
-                    )
+        def overlaps(s, e) -> bool:
+            # every turquoise stroke in a batch is drawn before every white one,
+            # so crossing bonds can't share one
+            found = pending.query(*box(s, e))
+            return any(segments_distance(s, e, *batch[k]) < 10 for k in found)
+
+        def bond(s, e):
+            if merge_bonds:
+                if batch and overlaps(s, e):
+                    flush()
+                pending.insert(len(batch), *box(s, e))
+                batch.append((s, e))
+                return
+            molecules.append(
+                dw.Line(
+                    *s,
+                    *e,
+                    stroke=turquoise,
+                    stroke_width=10,
+                    stroke_linecap="round",
                 )
-                molecules.append(
-                    dw.Line(
-                        *(center + vec2(s[0], s[1]) - u),
-                        *(center + vec2(e[0], e[1]) - u),
-                        stroke="white",
-                        stroke_width=4,
-                        stroke_linecap="round",
-                    )
+            )
+            molecules.append(
+                dw.Line(
+                    *s,
+                    *e,
+                    stroke="white",
+                    stroke_width=4,
+                    stroke_linecap="round",
                 )
+            )
 
-                molecules.append(
-                    dw.Line(
-                        *(center + vec2(s[0], s[1]) + u),
-                        *(center + vec2(e[0], e[1]) + u),
-                        stroke=turquoise,
-                        stroke_width=10,
-                        stroke_linecap="round",
+        k = 0
+        for i in order.tolist():
+            a = elements[i]
+
+            if shadowed[i]:
+                shadows.append(
+                    dw.Ellipse(
+                        *floors[i],
+                        2 * atom_radii[a],
+                        atom_radii[a],
+                        fill=rgb(0.95, 0.95, 0.95),
+                        stroke="none",
                     )
                 )
+
+            if visible[i]:
+                if batch and (
+                    len(batch) >= max_batch or covers(atoms[i], atom_radii[a])
+                ):
+                    flush()
+
                 molecules.append(
-                    dw.Line(
-                        *(center + vec2(s[0], s[1]) + u),
-                        *(center + vec2(e[0], e[1]) + u),
-                        stroke="white",
-                        stroke_width=4,
-                        stroke_linecap="round",
+                    dw.Circle(
+                        *atoms[i],
+                        atom_radii[a],
+                        fill="white",
+                        stroke=atom_colors[a],
+                        stroke_width=3,
                     )
                 )
 
-            done[i] = True
+            while k < len(drawn_after) and drawn_after[k] == i:
+                for s, e in strokes[k]:
+                    bond(s, e)
+                k += 1
 
-        labels.append(
-            dw.Text(
-                f"{mol.name} ({mol.formula})",
-                "22.5px",
-                *(center + vec2(0, bond_length * 0.75)),
-                center=True,
-                font_family=font_family,
-                stroke="white",
-                stroke_width=5,
-                paint_order="stroke",
-            )
-        )
+        if batch:
+            flush()
 
     reaction_box_size = 0.75 * width / 2
     reaction_box_top = height / 2 - reaction_box_size / 2
@@ -236,6 +454,7 @@ def reaction(*, title: str, reactants: list[Molecule], products: list[Molecule],
         theta = product_angle + i * tau / len(reactants)
         molecule(mol, c + radius * vec2(cos(theta) * 1.5, sin(theta)))
 
+    scene()
     d.append(shadows)
 
     d.append(
@@ -0,0 +1,240 @@
+import time
+
+from diagram import lazy
+
+np = lazy("numpy")
+
+# graphs up to this many nodes are solved exactly with dynamic programming,
+# which takes 2**n memory but no search
+MAX_DP = 20
+
+
+def bits(mask: int):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def dp(succ: list[int], pred: list[int]) -> list[int] | None:
+    # ends[mask] has a bit for each node that some path starting at node 0 and
+    # visiting exactly the nodes in mask can end at; masks are filled in by
+    # their number of nodes, one node at a time for all masks at once
+    n = len(succ)
+    masks = np.arange(1 << n, dtype=np.int64)
+    ends = np.zeros(1 << n, dtype=np.int64)
+    ends[1] = 1
+    count = np.zeros(1 << n, dtype=np.int64)
+    for v in range(n):
+        count += (masks >> v) & 1
+    layers = np.argsort(count, kind="stable")
+    bounds = np.searchsorted(count[layers], np.arange(n + 2))
+    for size in range(2, n + 1):
+        layer = layers[bounds[size] : bounds[size + 1]]
+        layer = layer[(layer & 1) == 1]
+        for v in range(1, n):
+            m = layer[((layer >> v) & 1) == 1]
+            ok = (ends[m ^ (1 << v)] & pred[v]) != 0
+            ends[m[ok]] |= 1 << v
+
+    full = (1 << n) - 1
+    last = [v for v in bits(int(ends[full]) & pred[0])]
+    if not last:
+        return None
+    cycle = [last[0]]
+    mask = full
+    while len(cycle) < n:
+        v = cycle[-1]
+        mask ^= 1 << v
+        cycle.append(next(bits(int(ends[mask]) & pred[v])))
+    return cycle[::-1]
+
+
+def joins(edges, size) -> bool:
+    # whether the edges, all of which have to be in the cycle, close a cycle
+    # through fewer than size nodes
+    parent = {}
+
+    def root(u):
+        while parent.get(u, u) != u:
+            parent[u] = parent.get(parent[u], parent[u])
+            u = parent[u]
+        return u
+
+    count = {}
+    for u, w in edges:
+        a, b = root(u), root(w)
+        if a == b:
+            if count.get(a, 1) < size:
+                return True
+            continue
+        parent[b] = a
+        count[a] = count.get(a, 1) + count.get(b, 1)
+    return False
+
+
+def reaches(adj, v, left) -> bool:
+    # whether every node in left can be reached from v through nodes in left
+    reached = 0
+    frontier = adj[v] & left
+    while frontier:
+        reached |= frontier
+        step = 0
+        for u in bits(frontier):
+            step |= adj[u]
+        frontier = step & left & ~reached
+    return reached == left
+
+
+def undirected_options(adj, v, left) -> list[int]:
+    # each node left needs two edges to the others left or the ends of the
+    # path, which need one each (or two for a path of just the start node);
+    # whenever a node has only as many edges as it needs they're all forced,
+    # and once a node has all the forced edges it needs, its others are removed
+    end = 1 << v
+    ends = end | 1
+    avail = {u: adj[u] & (left | ends) for u in bits(left)}
+    need = dict.fromkeys(avail, 2)
+    avail[v] = adj[v] & left
+    need[v] = 2 if v == 0 else 1
+    if v != 0:
+        avail[0] = adj[0] & left
+        need[0] = 1
+    forced = dict.fromkeys(avail, 0)
+
+    queue = list(avail)
+    while queue:
+        u = queue.pop()
+        if avail[u].bit_count() < need[u]:
+            return []
+        if avail[u].bit_count() > need[u] or forced[u] == avail[u]:
+            continue
+        for w in bits(avail[u] & ~forced[u]):
+            forced[u] |= 1 << w
+            forced[w] |= 1 << u
+            if forced[w].bit_count() > need[w]:
+                return []
+            if forced[w].bit_count() == need[w] and avail[w] != forced[w]:
+                for x in bits(avail[w] & ~forced[w]):
+                    avail[x] &= ~(1 << w)
+                    queue.append(x)
+                avail[w] = forced[w]
+
+    edges = [(u, w) for u, f in forced.items() for w in bits(f) if u < w]
+    if joins(edges, len(avail)) or not reaches(avail, v, left):
+        return []
+    return order(avail, forced[v] or avail[v], left)
+
+
+def directed_options(succ, pred, v, left) -> list[int]:
+    # the same for directed graphs, where each node left needs one edge in and
+    # one edge out, the end of the path one out, and the start one in
+    end = 1 << v
+    outs = {u: succ[u] & (left | 1) for u in bits(left)}
+    ins = {u: pred[u] & (left | end) for u in bits(left)}
+    outs[v] = succ[v] & left
+    ins[0] = pred[0] & left
+
+    # each entry is a node along with the side of its edges to look at, and the
+    # opposite side of the nodes at their other ends
+    queue = [(outs, ins, u) for u in outs] + [(ins, outs, u) for u in ins]
+    while queue:
+        edges, back, u = queue.pop()
+        if not edges[u]:
+            return []
+        w = edges[u].bit_length() - 1
+        if edges[u] == 1 << w and back[w] != 1 << u:
+            # the edge between u and w is forced, so no other node can use w's
+            # side of it
+            for x in bits(back[w] & ~(1 << u)):
+                edges[x] &= ~(1 << w)
+                queue.append((edges, back, x))
+            back[w] = 1 << u
+
+    edges = [(u, f.bit_length() - 1) for u, f in outs.items() if f.bit_count() == 1]
+    if joins(edges, len(outs) + (v != 0)):
+        return []
+    if not reaches(outs, v, left) or not reaches(ins, 0, left):
+        return []
+    return order(outs, outs[v], left)
+
+
+def order(adj, nexts, left) -> list[int]:
+    # the most constrained nodes first, popped from the end of the list
+    nexts = list(bits(nexts))
+    nexts.sort(key=lambda u: (adj[u] & left).bit_count(), reverse=True)
+    return nexts
+
+
+def search(succ, pred, *, directed, deadline) -> list[int] | None:
+    # depth-first search for a cycle through node 0, extending a path from it
+    # one node at a time and abandoning a path as soon as the nodes left over
+    # can no longer all be fitted in
+    n = len(succ)
+    full = (1 << n) - 1
+
+    def options(v, visited):
+        if directed:
+            return directed_options(succ, pred, v, full & ~visited)
+        return undirected_options(succ, v, full & ~visited)
+
+    path = [0]
+    visited = 1
+    stack = [options(0, visited)]
+    steps = 0
+    while stack:
+        steps += 1
+        if deadline is not None and steps % 64 == 0 and time.monotonic() > deadline:
+            raise TimeoutError("ran out of time looking for a Hamiltonian cycle")
+        if not stack[-1]:
+            stack.pop()
+            visited ^= 1 << path.pop()
+            continue
+        u = stack[-1].pop()
+        path.append(u)
+        visited |= 1 << u
+        if len(path) == n:
+            if succ[u] & 1:
+                return path
+            visited ^= 1 << path.pop()
+            continue
+        stack.append(options(u, visited))
+    return None
+
+
+def hamiltonian_cycle(graph, *, budget=None) -> list | None:
+    # the nodes of a networkx graph in the order of some cycle that visits each
+    # of them exactly once, starting from the graph's first node, or None if
+    # there isn't one; edges of undirected graphs can be used either way, and
+    # the search gives up with TimeoutError after budget seconds
+    nodes = list(graph)
+    n = len(nodes)
+    directed = graph.is_directed()
+    if n == 0:
+        return None
+    if n == 1:
+        return nodes if graph.has_edge(nodes[0], nodes[0]) else None
+    if n == 2 and not directed:
+        return None
+    index = {v: i for i, v in enumerate(nodes)}
+    succ = [0] * n
+    pred = [0] * n
+    for u, v in graph.edges():
+        i, j = index[u], index[v]
+        succ[i] |= 1 << j
+        pred[j] |= 1 << i
+        if not directed:
+            succ[j] |= 1 << i
+            pred[i] |= 1 << j
+
+    # self-loops are never part of a cycle through more than one node
+    for i in range(n):
+        succ[i] &= ~(1 << i)
+        pred[i] &= ~(1 << i)
+
+    if n <= MAX_DP:
+        cycle = dp(succ, pred)
+    else:
+        deadline = None if budget is None else time.monotonic() + budget
+        cycle = search(succ, pred, directed=directed, deadline=deadline)
+    return None if cycle is None else [nodes[i] for i in cycle]
@@ -1,38 +1,950 @@
 #!/usr/bin/env python3
 
+from __future__ import annotations
+
 import argparse
+import contextlib
+import dataclasses
+import functools
+import gzip
 import importlib
+import importlib.util
+import io
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from math import sqrt, tau
+from operator import itemgetter
 from pathlib import Path
 
 import drawsvg as dw
-from numpy import array, ndarray
-from numpy.linalg import norm
+from drawsvg.drawing import SVG_END, SVG_START, XML_HEADER
+
+import cache
+
+
+# A module that is only actually imported the first time one of its attributes
+# is used, for heavy dependencies that not every diagram needs.
+def lazy(name: str):
+    if name in sys.modules:
+        # possibly made lazy by another copy of this module, like __main__'s
+        _lazy[name] = sys.modules[name]
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    _lazy[name] = module
+    return module
+
+
+# every module lazy() has returned, by name, loaded or not
+_lazy = {}
+
+
+def load_lazy():
+    # any attribute access finishes importing a lazy module
+    for module in _lazy.values():
+        module.__name__
+
+
+np = lazy("numpy")
+# only needed for profiling
+cProfile = lazy("cProfile")
+tracemalloc = lazy("tracemalloc")
 
 
 def rgb(r, g, b) -> str:
     return f"#{int(r * 255):02x}{int(g * 255):02x}{int(b * 255):02x}"
 
 
-Vec = ndarray
-Vec2 = Vec
-Vec3 = Vec
+# tuple-backed vectors: diagrams do their geometry on thousands of 2- and
+# 3-element vectors, where NumPy's per-call overhead dwarfs the arithmetic
+_new = tuple.__new__
+
+
+class Vec2(tuple):
+    __slots__ = ()
+
+    x = property(itemgetter(0))
+    y = property(itemgetter(1))
+
+    def __repr__(self):
+        return f"vec2{tuple.__repr__(self)}"
+
+    def __neg__(self) -> "Vec2":
+        x, y = self
+        return _new(Vec2, (-x, -y))
+
+    def __add__(self, other: "Vec2") -> "Vec2":
+        x, y = self
+        a, b = other
+        return _new(Vec2, (x + a, y + b))
+
+    def __sub__(self, other: "Vec2") -> "Vec2":
+        x, y = self
+        a, b = other
+        return _new(Vec2, (x - a, y - b))
+
+    def __mul__(self, s) -> "Vec2":
+        x, y = self
+        return _new(Vec2, (x * s, y * s))
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, s) -> "Vec2":
+        x, y = self
+        return _new(Vec2, (x / s, y / s))
+
+    def dot(self, other: "Vec2"):
+        x, y = self
+        a, b = other
+        return x * a + y * b
+
+    def cross(self, other: "Vec2"):
+        x, y = self
+        a, b = other
+        return x * b - y * a
+
+    def norm(self):
+        x, y = self
+        return sqrt(x * x + y * y)
+
+
+class Vec3(tuple):
+    __slots__ = ()
+
+    x = property(itemgetter(0))
+    y = property(itemgetter(1))
+    z = property(itemgetter(2))
+
+    def __repr__(self):
+        return f"vec3{tuple.__repr__(self)}"
+
+    def __neg__(self) -> "Vec3":
+        x, y, z = self
+        return _new(Vec3, (-x, -y, -z))
+
+    def __add__(self, other: "Vec3") -> "Vec3":
+        x, y, z = self
+        a, b, c = other
+        return _new(Vec3, (x + a, y + b, z + c))
+
+    def __sub__(self, other: "Vec3") -> "Vec3":
+        x, y, z = self
+        a, b, c = other
+        return _new(Vec3, (x - a, y - b, z - c))
+
+    def __mul__(self, s) -> "Vec3":
+        x, y, z = self
+        return _new(Vec3, (x * s, y * s, z * s))
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, s) -> "Vec3":
+        x, y, z = self
+        return _new(Vec3, (x / s, y / s, z / s))
+
+    def dot(self, other: "Vec3"):
+        x, y, z = self
+        a, b, c = other
+        return x * a + y * b + z * c
+
+    def cross(self, other: "Vec3") -> "Vec3":
+        x, y, z = self
+        a, b, c = other
+        return _new(Vec3, (y * c - z * b, z * a - x * c, x * b - y * a))
+
+    def norm(self):
+        x, y, z = self
+        return sqrt(x * x + y * y + z * z)
+
+
+Vec = Vec2 | Vec3
 
 
 def vec2(x, y) -> Vec2:
-    return array([x, y])
+    return _new(Vec2, (x, y))
 
 
 def vec3(x, y, z) -> Vec3:
-    return array([x, y, z])
+    return _new(Vec3, (x, y, z))
 
 
 def normalize(v: Vec) -> Vec:
-    return v / norm(v)
+    return v / v.norm()
 
 
 def rot90(v: Vec2) -> Vec2:
     x, y = v
-    return vec2(-y, x)
+    return _new(Vec2, (-y, x))
+
+
+def segment_distance(p, a, b) -> float:
+    # from the point p to the closest point of the segment from a to b
+    px, py = p
+    ax, ay = a
+    dx, dy = b[0] - ax, b[1] - ay
+    length2 = dx * dx + dy * dy
+    t = 0 if length2 == 0 else ((px - ax) * dx + (py - ay) * dy) / length2
+    t = max(0, min(1, t))
+    x, y = ax + t * dx - px, ay + t * dy - py
+    return sqrt(x * x + y * y)
+
+
+def segments_distance(a, b, c, d) -> float:
+    # between the closest points of the segment from a to b and the one from c
+    # to d, which is zero if they cross
+    def side(p, q, r):
+        return (q[0] - p[0]) * (r[1] - p[1]) - (q[1] - p[1]) * (r[0] - p[0])
+
+    if side(a, b, c) * side(a, b, d) < 0 and side(c, d, a) * side(c, d, b) < 0:
+        return 0.0
+    return min(
+        segment_distance(a, c, d),
+        segment_distance(b, c, d),
+        segment_distance(c, a, b),
+        segment_distance(d, a, b),
+    )
+
+
+# batched counterparts of the helpers above, for whole diagrams at a time: each
+# takes (N, 2) or (N, 3) arrays with one vector per row
+
+
+def normalize_many(v: np.ndarray) -> np.ndarray:
+    return v / np.sqrt(np.einsum("ij,ij->i", v, v))[:, None]
+
+
+def rot90_many(v: np.ndarray) -> np.ndarray:
+    return np.stack([-v[:, 1], v[:, 0]], axis=1)
+
+
+def midpoints(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return (a + b) / 2
+
+
+def segment_distances(p: np.ndarray, a, b) -> np.ndarray:
+    # from each point to the closest point of the segment from a to b
+    d = np.subtract(b, a)
+    length2 = d @ d
+    s = np.zeros(len(p)) if length2 == 0 else np.clip((p - a) @ d / length2, 0, 1)
+    q = p - a - s[:, None] * d
+    return np.sqrt(np.einsum("ij,ij->i", q, q))
+
+
+def arrowheads(tips: np.ndarray, t: np.ndarray, *, length, half_width, notch=None):
+    # (N, 3, 2) triangles pointing along the unit vectors t, or (N, 4, 2) with
+    # an extra vertex that far back from the tip
+    n = rot90_many(t) * half_width
+    back = tips - t * length
+    corners = [tips, back - n]
+    if notch is not None:
+        corners.append(tips - t * notch)
+    corners.append(back + n)
+    return np.stack(corners, axis=1)
+
+
+def label_offsets(thetas, r) -> np.ndarray:
+    # the same convention as the diagrams use: y points down, angles go ccw
+    thetas = np.asarray(thetas, dtype=float)
+    return r * np.stack([np.cos(thetas), -np.sin(thetas)], axis=-1)
+
+
+class Grid:
+    # a uniform grid of square cells, indexing items by their bounding boxes
+    def __init__(self, cell):
+        self.cell = cell
+        self.cells = defaultdict(list)
+
+    def keys(self, x0, y0, x1, y1):
+        c = self.cell
+        for i in range(int(x0 // c), int(x1 // c) + 1):
+            for j in range(int(y0 // c), int(y1 // c) + 1):
+                yield i, j
+
+    def insert(self, item, x0, y0, x1, y1):
+        for key in self.keys(x0, y0, x1, y1):
+            self.cells[key].append(item)
+
+    def query(self, x0, y0, x1, y1) -> list:
+        # every item whose box might overlap this one, each once
+        found = {}
+        for key in self.keys(x0, y0, x1, y1):
+            for item in self.cells.get(key, ()):
+                found[item] = None
+        return list(found)
+
+
+def text_box(text: str, size) -> tuple[float, float]:
+    # a rough width and height for a label set in a font of this many pixels
+    return 0.6 * size * len(text), 0.75 * size
+
+
+def clipped_length(a, b, box) -> float:
+    # how much of the segment from a to b is inside the box (Liang-Barsky)
+    (ax, ay), (bx, by) = a, b
+    x0, y0, x1, y1 = box
+    dx, dy = bx - ax, by - ay
+    lo, hi = 0.0, 1.0
+    for p, q in [(-dx, ax - x0), (dx, x1 - ax), (-dy, ay - y0), (dy, y1 - ay)]:
+        if p == 0:
+            if q < 0:
+                return 0.0
+        elif p < 0:
+            lo = max(lo, q / p)
+        else:
+            hi = min(hi, q / p)
+    return max(0.0, hi - lo) * sqrt(dx * dx + dy * dy)
+
+
+def place_labels(
+    points,
+    sizes,
+    thetas,
+    *,
+    distance,
+    dot=0,
+    segments=(),
+    stroke_width=2,
+    bounds=None,
+    tries=16,
+):
+    # Centers for labels of the given (width, height) sizes, each at the given
+    # distance from its point at one of several angles: the preferred angle in
+    # thetas, or else the one closest to it whose box overlaps the least with
+    # the points (as squares of side 2 * dot), the segments, the labels placed
+    # before it, and the outside of the bounds. A grid of everything placed so
+    # far keeps each check proportional to what's nearby.
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    sizes = np.broadcast_to(np.asarray(sizes, dtype=float), points.shape)
+    # the preferred angle first, then alternating to either side of it
+    steps = np.array([0] + [s * k for k in range(1, tries // 2 + 1) for s in [1, -1]])
+    steps = steps[:tries] * tau / tries
+    thetas = np.asarray(thetas, dtype=float)[:, None] + steps
+    candidates = (points[:, None] + label_offsets(thetas, distance)).tolist()
+
+    grid = Grid(max(2 * distance, sizes.max(initial=1)))
+    shapes = []
+
+    def add(shape, x0, y0, x1, y1):
+        grid.insert(len(shapes), x0, y0, x1, y1)
+        shapes.append(shape)
+
+    if dot > 0:
+        for x, y in points.tolist():
+            box = (x - dot, y - dot, x + dot, y + dot)
+            add((True, box), *box)
+    for a, b in np.asarray(segments, dtype=float).reshape(-1, 2, 2).tolist():
+        add(
+            (False, (a, b)),
+            min(a[0], b[0]),
+            min(a[1], b[1]),
+            max(a[0], b[0]),
+            max(a[1], b[1]),
+        )
+
+    def cost(box) -> float:
+        x0, y0, x1, y1 = box
+        total = 0.0
+        for k in grid.query(*box):
+            is_box, shape = shapes[k]
+            if is_box:
+                u0, v0, u1, v1 = shape
+                w = min(x1, u1) - max(x0, u0)
+                h = min(y1, v1) - max(y0, v0)
+                if w > 0 and h > 0:
+                    total += w * h
+            else:
+                total += stroke_width * clipped_length(*shape, box)
+        if bounds is not None:
+            b0, c0, b1, c1 = bounds
+            inside = max(0, min(x1, b1) - max(x0, b0)) * max(
+                0, min(y1, c1) - max(y0, c0)
+            )
+            total += (x1 - x0) * (y1 - y0) - inside
+        return total
+
+    placed = []
+    for (w, h), options in zip(sizes.tolist(), candidates):
+        best = None
+        for x, y in options:
+            box = (x - w / 2, y - h / 2, x + w / 2, y + h / 2)
+            c = cost(box)
+            if best is None or c < best[0]:
+                best = (c, x, y, box)
+                if c == 0:
+                    break
+        _, x, y, box = best
+        add((True, box), *box)
+        placed.append((x, y))
+    return np.array(placed).reshape(-1, 2)
+
+
+# Compact output: numbers are rounded to a fixed number of decimals as they're
+# written, and attributes that children inherit from their parents are set once
+# on a group around each run of siblings that share them, instead of on every
+# sibling. Neither changes how the drawing looks at any reasonable zoom.
+INHERITED = {
+    "fill",
+    "fill-opacity",
+    "fill-rule",
+    "font-family",
+    "font-size",
+    "font-style",
+    "font-weight",
+    "paint-order",
+    "stroke",
+    "stroke-dasharray",
+    "stroke-linecap",
+    "stroke-linejoin",
+    "stroke-miterlimit",
+    "stroke-opacity",
+    "stroke-width",
+    "text-anchor",
+}
+
+# inherited attributes that only matter to text, so shapes can go in a group
+# that sets them without breaking its run
+TEXT_ONLY = {
+    "font-family",
+    "font-size",
+    "font-style",
+    "font-weight",
+    "text-anchor",
+}
+SHAPES = (dw.Circle, dw.Ellipse, dw.Image, dw.Path, dw.Rectangle)
+
+# hex colors and ids are matched only so that they're left alone
+NUMBER = re.compile(r"#\w+|-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+
+
+def fixed(x: float, digits: int) -> str:
+    s = f"{x:.{digits}f}"
+    if "." in s:
+        s = s.rstrip("0").rstrip(".")
+    if s == "-0":
+        return "0"
+    return s.replace("0.", ".", 1) if s.lstrip("-").startswith("0.") else s
+
+
+@dataclasses.dataclass(frozen=True)
+class Compact(dw.types.Context):
+    digits: int = 2
+
+    def round(self, match) -> str:
+        s = match.group()
+        if s.startswith("#") or not any(c in s for c in ".eE"):
+            return s
+        return fixed(float(s), self.digits)
+
+    def override_args(self, args):
+        args = super().override_args(args)
+        for k, v in args.items():
+            if k in ("id", "href", "xlink:href"):
+                continue
+            if isinstance(v, float):
+                args[k] = fixed(v, self.digits)
+            elif isinstance(v, str):
+                args[k] = NUMBER.sub(self.round, v)
+        return args
+
+
+def children(element) -> list:
+    if isinstance(element, dw.Drawing):
+        return element.elements + [
+            e
+            for z in sorted(element.ordered_elements)
+            for e in element.ordered_elements[z]
+        ]
+    if isinstance(element, dw.DrawingParentElement):
+        return element.children + [
+            e
+            for z in sorted(element.ordered_children)
+            for e in element.ordered_children[z]
+        ]
+    return []
+
+
+def pinned(elements) -> set:
+    # the id()s of elements that are also drawn elsewhere, as defs or by being
+    # appended more than once, so must keep their own attributes
+    seen = Counter()
+    pins = set()
+
+    def visit(e):
+        seen[id(e)] += 1
+        if seen[id(e)] > 1:
+            pins.add(id(e))
+            return
+        pins.update(id(d) for d in e.get_svg_defs())
+        for child in children(e):
+            visit(child)
+
+    for e in elements:
+        visit(e)
+    return pins
+
+
+def inherited(element, pins) -> dict:
+    if id(element) in pins or not isinstance(element, dw.DrawingBasicElement):
+        return {}
+    if isinstance(element, dw.Animate):
+        return {}  # where fill means something else
+    return {
+        k: v
+        for k, v in element.args.items()
+        if k in INHERITED and isinstance(v, (str, int, float))
+    }
+
+
+def hoist(elements: list, pins) -> list:
+    # wraps each run of siblings sharing some attributes in a group with them,
+    # then does the same inside each new group for what's left
+    out = []
+
+    def flush(run, shared):
+        if len(run) < 2:
+            out.extend(run)
+            return
+        g = dw.Group()
+        g.args.update(shared)
+        for e in run:
+            for k in shared:
+                e.args.pop(k, None)
+        g.children = hoist(run, pins)
+        out.append(g)
+
+    run, shared = [], {}
+    for e in elements:
+        attrs = inherited(e, pins)
+        if isinstance(e, SHAPES) and id(e) not in pins:
+            attrs = {**{k: shared[k] for k in TEXT_ONLY & shared.keys()}, **attrs}
+        common = {k: v for k, v in shared.items() if k in attrs and attrs[k] == v}
+        if common:
+            run.append(e)
+            shared = common
+        else:
+            flush(run, shared)
+            run, shared = [e], attrs
+    flush(run, shared)
+    return out
+
+
+def compact(element, pins):
+    # hoists attributes within everything below the element; only the element
+    # itself is left where it was
+    if isinstance(element, Spill) or not isinstance(element, (dw.Drawing, dw.Group)):
+        return
+    original = children(element)
+    for e in original:
+        compact(e, pins)
+    elements = hoist(original, pins)
+    if isinstance(element, dw.Drawing):
+        element.elements = elements
+        element.ordered_elements.clear()
+        return
+    if len(elements) == 1 and elements[0] not in original:
+        # every child shared them, so they can go on the element instead
+        (g,) = elements
+        element.args.update(g.args)
+        elements = g.children
+    element.children = elements
+    element.ordered_children.clear()
+
+
+def compact_context(context, digits) -> Compact:
+    return Compact(context.invert_y, context.animation_config, digits)
+
+
+def compact_drawing(d: dw.Drawing, digits):
+    d.context = compact_context(d.context, digits)
+    compact(d, pinned(children(d)))
+
+
+@contextlib.contextmanager
+def output(out):
+    # a text file to write the SVG to, gzipped if it's an .svgz; it only
+    # replaces out once it's complete, so a diagram that fails partway leaves
+    # the last good one in place
+    out = Path(out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out.with_name(f"{out.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp, "wb") as raw:
+            if out.suffix == ".svgz":
+                # without a timestamp, so the same drawing is always the same file
+                z = gzip.GzipFile(filename="", mode="wb", fileobj=raw, mtime=0)
+            else:
+                z = contextlib.nullcontext(raw)
+            with z as binary, io.TextIOWrapper(binary, encoding="utf-8") as f:
+                yield f
+        os.replace(tmp, out)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+class Drawing(dw.Drawing):
+    def group(self, **kwargs) -> dw.Group:
+        return dw.Group(**kwargs)
+
+
+# A Drawing that serializes each element to its file as soon as it's appended,
+# so memory doesn't grow with the number of elements. Anything appended must
+# already be complete. Groups from group() spill their children to temporary
+# buffers, so they can be filled in while other elements are being appended
+# and then written out wherever they're appended themselves.
+class Stream(Drawing):
+    def __init__(self, width, height, file, *, digits=None, **kwargs):
+        super().__init__(width, height, **kwargs)
+        self.file = file
+        self.digits = digits
+        if digits is not None:
+            self.context = compact_context(self.context, digits)
+        self.ids = defaultdict(lambda: f"{self.id_prefix}{len(self.ids)}")
+        # the elements written as defs, kept alive so that their id()s, which
+        # the maps above go by, can't be reused by later elements
+        self.defined = {}
+
+        args = dict(zip(["width", "height"], self.calc_render_size()))
+        args["viewBox"] = " ".join(map(str, self.view_box))
+        args.update(self.svg_args)
+        file.write(XML_HEADER)
+        file.write(SVG_START)
+        self.context.write_svg_document_args(self, args, file)
+        file.write(">\n")
+
+    def group(self, **kwargs) -> dw.Group:
+        return Spill(self, **kwargs)
+
+    def write(self, element, file, parent):
+        with phase("serialize"):
+            self._write(element, file, parent)
+
+    def _write(self, element, file, parent):
+        def is_defined(obj) -> bool:
+            if id(obj) in self.defined:
+                return True
+            self.defined[id(obj)] = obj
+            return False
+
+        if self.digits is not None:
+            compact(element, pinned([element]))
+        local = dw.types.LocalContext(self.context, element, parent)
+        defs = io.StringIO()
+        element.write_svg_defs(self.ids, is_defined, defs, local, False)
+        if defs.tell():
+            file.write(f"<defs>\n{defs.getvalue()}</defs>\n")
+        element.write_svg_element(self.ids, lambda _: False, file, local, False)
+        file.write("\n")
+
+    def append(self, element, *, z=None):
+        if z is not None:
+            raise ValueError("Streamed drawings can't reorder elements")
+        self.write(element, self.file, self)
+
+    def extend(self, iterable, *, z=None):
+        for element in iterable:
+            self.append(element, z=z)
+
+    def finish(self):
+        self.file.write(SVG_END)
+
+
+class Spill(dw.Group):
+    def __init__(self, stream: Stream, **kwargs):
+        super().__init__(**kwargs)
+        self.stream = stream
+        self.buffer = tempfile.SpooledTemporaryFile(2**20, "w+", encoding="utf-8")
+        self.written = False
+
+    def append(self, element, *, z=None):
+        if z is not None:
+            raise ValueError("Streamed groups can't reorder elements")
+        if self.written:
+            raise RuntimeError("Group was already written")
+        self.stream.write(element, self.buffer, self)
+
+    def extend(self, iterable, *, z=None):
+        for element in iterable:
+            self.append(element, z=z)
+
+    def write_content(self, id_map, is_duplicate, output_file, lcontext, dry_run):
+        if not dry_run:
+            output_file.write("\n")
+            self.buffer.seek(0)
+            shutil.copyfileobj(self.buffer, output_file)
+            self.buffer.close()
+            self.written = True
+
+
+# set by render() while a streamed diagram is being drawn, to the file and the
+# digits to compact it to
+_stream = None
+
+
+def drawing(width, height, **kwargs) -> Drawing:
+    global _stream
+    if _stream is None:
+        return Drawing(width, height, **kwargs)
+    (file, digits), _stream = _stream, None
+    return Stream(width, height, file, digits=digits, **kwargs)
+
+
+def save(d, out, *, digits=None):
+    # digits, if given, is how many decimals to round to in compact output
+    if not isinstance(d, dw.Drawing):
+        raise TypeError(f"Expected Drawing, got {type(d)}")
+    if digits is not None:
+        compact_drawing(d, digits)
+    with output(out) as f:
+        d.as_svg(output_file=f)
+
+
+# Parts of rendering a diagram, timed and measured while it's being profiled.
+# Each phase is nested in whichever phases were open when it started, and
+# appears in the summary once per nesting, with the total over its calls.
+class Profiler:
+    def __init__(self):
+        self.start = time.perf_counter()
+        # name, start, and the peak memory so far of each open phase
+        self.stack = []
+        # path of names, start, end, and peak memory above the start of each
+        # phase that has ended
+        self.events = []
+        # time spent in parts too small and too many to be phases of their own
+        self.tallies = defaultdict(float)
+
+    def path(self, name) -> tuple[str, ...]:
+        return (*(p[0] for p in self.stack), name)
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        # the peak so far belongs to the enclosing phase, and a new one starts
+        current, peak = tracemalloc.get_traced_memory()
+        if self.stack:
+            self.stack[-1][2] = max(self.stack[-1][2], peak)
+        tracemalloc.reset_peak()
+        self.stack.append([name, time.perf_counter(), current])
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            _, peak = tracemalloc.get_traced_memory()
+            path = tuple(p[0] for p in self.stack)
+            _, start, top = self.stack.pop()
+            peak = max(top, peak)
+            if self.stack:
+                self.stack[-1][2] = max(self.stack[-1][2], peak)
+            self.events.append((path, start, end, peak - current))
+
+    def tally(self, name: str, seconds: float):
+        self.tallies[self.path(name)] += seconds
+
+    def summary(self):
+        rows = {}
+        for path, start, end, peak in self.events:
+            calls, seconds, most = rows.get(path, (0, 0.0, 0))
+            rows[path] = (calls + 1, seconds + end - start, max(most, peak))
+        for path, seconds in self.tallies.items():
+            rows[path] = (None, seconds, None)
+        total = sum(r[1] for path, r in rows.items() if len(path) == 1)
+
+        # each phase after the one it's nested in, in the order they started
+        first = {}
+        for path, start, _, _ in sorted(self.events, key=lambda e: e[1]):
+            first.setdefault(path, start)
+        infinity = float("inf")
+
+        def order(path):
+            return [first.get(path[: k + 1], infinity) for k in range(len(path))]
+
+        print(f"{'phase':<32} {'calls':>6} {'time':>9} {'share':>6} {'peak':>9}")
+        for path in sorted(rows, key=order):
+            calls, seconds, peak = rows[path]
+            name = "  " * (len(path) - 1) + path[-1]
+            calls = "" if calls is None else calls
+            peak = "" if peak is None else f"{peak / 2**20:.1f}MB"
+            print(
+                f"{name:<32} {calls:>6} {seconds * 1000:>7.1f}ms"
+                f" {seconds / total:>6.1%} {peak:>9}"
+            )
+        print(f"{'total':<32} {'':>6} {total * 1000:>7.1f}ms")
+
+    def trace(self, out):
+        # in Chrome's trace event format, for chrome://tracing or Perfetto
+        events = []
+        for path, start, end, peak in sorted(self.events, key=lambda e: e[1]):
+            args = {"peak_bytes": peak}
+            for tally, seconds in self.tallies.items():
+                if tally[:-1] == path:
+                    args[f"{tally[-1]}_seconds"] = seconds
+            events.append(
+                {
+                    "name": path[-1],
+                    "ph": "X",
+                    "ts": (start - self.start) * 1e6,
+                    "dur": (end - start) * 1e6,
+                    "pid": 1,
+                    "tid": 1,
+                    "args": args,
+                }
+            )
+        Path(out).write_text(json.dumps({"traceEvents": events}))
+
+
+# set by profile() while a diagram is being profiled
+_profiler = None
+
+
+def phase(name: str):
+    # a context manager around a part of drawing a diagram, which is timed and
+    # measured on its own while the diagram is being profiled
+    if _profiler is None:
+        return contextlib.nullcontext()
+    return _profiler.phase(name)
+
+
+@contextlib.contextmanager
+def tally_elements(profiler: Profiler):
+    # times the constructor of every kind of drawsvg element, counting only the
+    # outermost one when they call each other
+    classes = []
+    stack = [dw.DrawingElement]
+    while stack:
+        cls = stack.pop()
+        stack.extend(cls.__subclasses__())
+        if "__init__" in vars(cls):
+            classes.append((cls, vars(cls)["__init__"]))
+    depth = 0
+
+    def timed(init):
+        @functools.wraps(init)
+        def wrapper(*args, **kwargs):
+            nonlocal depth
+            if depth:
+                return init(*args, **kwargs)
+            depth += 1
+            start = time.perf_counter()
+            try:
+                return init(*args, **kwargs)
+            finally:
+                depth -= 1
+                profiler.tally("elements", time.perf_counter() - start)
+
+        return wrapper
+
+    for cls, init in classes:
+        cls.__init__ = timed(init)
+    try:
+        yield
+    finally:
+        for cls, init in classes:
+            cls.__init__ = init
+
+
+def render(mod, func, out, *, stream=False, digits=None):
+    global _stream
+    with phase("import"):
+        draw = getattr(importlib.import_module(mod), func)
+        if _profiler is not None:
+            # or else each lazy module's import is charged to whichever phase
+            # happens to use it first
+            load_lazy()
+    if not stream:
+        with phase("compute"):
+            d = draw()
+        with phase("serialize"):
+            save(d, out, digits=digits)
+        return
+
+    with output(out) as f:
+        _stream = f, digits
+        try:
+            with phase("compute"):
+                d = draw()
+        finally:
+            _stream = None
+        with phase("serialize"):
+            if isinstance(d, Stream):
+                d.finish()
+            elif isinstance(d, dw.Drawing):
+                # the diagram didn't create its drawing with drawing()
+                if digits is not None:
+                    compact_drawing(d, digits)
+                d.as_svg(output_file=f)
+            else:
+                raise TypeError(f"Expected Drawing, got {type(d)}")
+
+
+def profile(mod, func, out, *, stream=False, digits=None, stats=None, trace=None):
+    # renders the diagram while timing each phase and tracking the most memory
+    # it took, then prints a summary; stats is a file for cProfile's results,
+    # and trace one for the phases in Chrome's trace event format
+    global _profiler
+    profiler = Profiler()
+    profiled = cProfile.Profile() if stats else None
+    tracemalloc.start()
+    _profiler = profiler
+    try:
+        with tally_elements(profiler):
+            if profiled is not None:
+                profiled.enable()
+            try:
+                render(mod, func, out, stream=stream, digits=digits)
+            finally:
+                if profiled is not None:
+                    profiled.disable()
+    finally:
+        _profiler = None
+        tracemalloc.stop()
+
+    profiler.summary()
+    if profiled is not None:
+        profiled.dump_stats(stats)
+    if trace:
+        profiler.trace(trace)
+
+
+def import_report(argv: list[str]) -> float:
+    # rerun the command under -X importtime and total the self time of every
+    # module by top-level package
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", __file__, *argv],
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    packages = defaultdict(int)
+    total = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            print(line, file=sys.stderr)
+            continue
+        us, cumulative, name = line.removeprefix("import time:").split("|")
+        if not us.strip().isdigit():
+            continue  # the header
+        packages[name.strip().split(".")[0]] += int(us)
+        if len(name) - len(name.lstrip()) == 1:
+            total += int(cumulative)
+    if result.returncode != 0:
+        sys.exit(result.returncode)
+
+    ranked = sorted(packages.items(), key=lambda item: -item[1])
+    print(f"{'package':<24} {'self':>9}")
+    for package, us in ranked[:15]:
+        print(f"{package:<24} {us / 1000:>7.1f}ms")
+    print(f"{'(other)':<24} {sum(us for _, us in ranked[15:]) / 1000:>7.1f}ms")
+    print(f"{'total':<24} {total / 1000:>7.1f}ms")
+    return total / 1e6
 
 
 def main():
@@ -40,15 +952,85 @@ def main():
     parser.add_argument("-m", "--mod", required=True)
     parser.add_argument("-f", "--func", required=True)
     parser.add_argument("-o", "--out", required=True)
+    parser.add_argument("--force", action="store_true", help="ignore the cache")
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="write elements as they're drawn instead of all at the end",
+    )
+    parser.add_argument(
+        "--compact",
+        nargs="?",
+        type=int,
+        const=2,
+        metavar="DIGITS",
+        help="round numbers to DIGITS decimals (default: 2) and set shared "
+        "attributes once on a group; write to an .svgz to also gzip it",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const=True,
+        metavar="FILE",
+        help="render without the cache and show the time and peak memory of "
+        "each phase, saving cProfile's results to FILE if given",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="like --profile, but save the phases to FILE as Chrome trace events",
+    )
+    parser.add_argument(
+        "--import-report",
+        action="store_true",
+        help="render without the cache and show how long imports took",
+    )
+    parser.add_argument(
+        "--import-budget",
+        type=float,
+        metavar="SECONDS",
+        help="like --import-report, but fail if imports took longer than this",
+    )
     args = parser.parse_args()
+    if args.compact is not None and args.compact < 0:
+        parser.error("--compact can't round to fewer than 0 digits")
 
-    d = getattr(importlib.import_module(args.mod), args.func)()
-    if isinstance(d, dw.Drawing):
-        Path(args.out).parent.mkdir(parents=True, exist_ok=True)
-        d.save_svg(args.out)
-    else:
-        raise TypeError(f"Expected Drawing, got {type(d)}")
+    flags = ["stream"] if args.stream else []
+    if args.compact is not None:
+        flags.append(f"compact={args.compact}")
+
+    if args.import_report or args.import_budget is not None:
+        argv = ["-m", args.mod, "-f", args.func, "-o", args.out, "--force"]
+        seconds = import_report(argv + [f"--{flag}" for flag in flags])
+        if args.import_budget is not None and seconds > args.import_budget:
+            sys.exit(
+                f"imports took {seconds:.3f}s, over the budget of {args.import_budget}s"
+            )
+        return
+    if args.profile or args.trace:
+        stats = args.profile if isinstance(args.profile, str) else None
+        profile(
+            args.mod,
+            args.func,
+            args.out,
+            stream=args.stream,
+            digits=args.compact,
+            stats=stats,
+            trace=args.trace,
+        )
+        return
+    key = cache.key(args.mod, args.func, *flags)
+    if not args.force and cache.restore(key, args.out):
+        print("cache: hit")
+        return
+    print("cache: miss")
+    render(args.mod, args.func, args.out, stream=args.stream, digits=args.compact)
+    cache.store(key, args.out)
 
 
 if __name__ == "__main__":
-    main()
+    # go through the importable module, so that diagrams and this script share
+    # one copy of it instead of each importing their own
+    import diagram
+
+    diagram.main()
@@ -1,71 +1,286 @@
+from __future__ import annotations
+
+import os
 import random
-from math import cos, sin, tau
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from math import tau
 
 import drawsvg as dw
-from numpy import cross
 
-from diagram import normalize, rgb, rot90, vec2
+from diagram import (
+    arrowheads,
+    drawing,
+    lazy,
+    normalize_many,
+    phase,
+    place_labels,
+    rgb,
+    rot90_many,
+    text_box,
+)
+
+np = lazy("numpy")
+
 
 Point = str
 Segment = frozenset[Point]  # must have exactly two points
 Angle = tuple[Point, Segment]  # vertex, then the other two points
 Triangle = frozenset[Point]  # must have exactly three points
+Construction = tuple[str, tuple[Point, ...]]  # kind, then its inputs
+
+
+# these take either vectors, or (2, N) arrays with a row each for x and y
+
+
+def cross(u, v):
+    return u[0] * v[1] - u[1] * v[0]
+
+
+def intersection(p, q, r, s):
+    # of the line through p and q with the line through r and s, which can't
+    # be parallel
+    u = q - p
+    v = s - r
+    d = cross(u, v)
+    if np.any(d == 0):
+        raise ValueError("the lines are parallel, so they don't intersect")
+    return p + u * (cross(r - p, v) / d)
+
+
+def foot(p, q, r):
+    # of the perpendicular from p to the line through q and r
+    u = r - q
+    w = p - q
+    return q + u * ((w[0] * u[0] + w[1] * u[1]) / (u[0] * u[0] + u[1] * u[1]))
+
+
+# how to compute each kind of derived point from the positions of its inputs
+CONSTRUCTIONS = {
+    "midpoint": lambda p, q: (p + q) / 2,
+    "intersection": intersection,
+    "foot": foot,
+}
+
+
+class Rows:
+    # a growable (N, k) array of point ids, holding each distinct row once in
+    # the order they were first added
+    def __init__(self, k: int):
+        self.k = k
+        self.data = array("i")
+        self._unique = None
+
+    def add(self, row):
+        self.data.extend(row)
+        self._unique = None
+
+    def array(self) -> np.ndarray:
+        if self._unique is None:
+            rows = np.frombuffer(self.data, dtype=np.int32).reshape(-1, self.k)
+            _, first = np.unique(rows, axis=0, return_index=True)
+            self._unique = rows[np.sort(first)]
+        return self._unique
+
+
+def contains(rows: np.ndarray, of: np.ndarray, n: int) -> np.ndarray:
+    # whether each row of ids, all less than n, is also one of the others
+    if not len(rows) or not len(of):
+        return np.zeros(len(rows), dtype=bool)
+    dims = (n,) * rows.shape[1]
+    return np.isin(np.ravel_multi_index(rows.T, dims), np.ravel_multi_index(of.T, dims))
 
 
 class Geometry:
-    points: dict[Point, None]
-    segments: set[Segment]
+    # Points are interned to integer ids the first time they're used, in the
+    # order that euclidean places them, and everything else is stored as rows
+    # of ids: (N, 2) for segments, (N, 3) for angles with the vertex first,
+    # and (N, 3) for triangles, with the ids of each set of points sorted.
+    points: dict[Point, int]
+    names: list[Point]
     midpoints: dict[Point, Segment]
-    angles: set[Angle]
-    triangles: set[Triangle]
-    bisectors: set[Angle]
-    perpendicular_bisectors: set[Segment]
+    derived: dict[Point, Construction]
+    dependents: dict[Point, list[Point]]
 
     def __init__(self):
         self.points = {}
-        self.segments = set()
+        self.names = []
         self.midpoints = {}
-        self.angles = set()
-        self.triangles = set()
-        self.bisectors = set()
-        self.perpendicular_bisectors = set()
+        self.derived = {}
+        self.dependents = {}
+        self._segments = Rows(2)
+        self._angles = Rows(3)
+        self._triangles = Rows(3)
+        self._bisectors = Rows(3)
+        self._perpendicular_bisectors = Rows(2)
+        self._order = None
+
+    def intern(self, p) -> int:
+        try:
+            return self.points[p]
+        except KeyError:
+            self.names.append(p)
+            i = self.points[p] = len(self.points)
+            return i
+
+    def ids(self, points) -> list[int]:
+        return sorted(map(self.intern, points))
 
     def point(self, p) -> Point:
-        self.points[p] = None
+        self.intern(p)
         return p
 
     def segment(self, p, q) -> Segment:
-        a = frozenset([p, q])
-        self.segments.add(a)
-        return a
+        self._segments.add(self.ids([p, q]))
+        return frozenset([p, q])
+
+    def construct(self, p, kind, *inputs) -> Point:
+        # a point whose position is computed from others, which can be defined
+        # before or after it
+        self.intern(p)
+        self.derived[p] = (kind, inputs)
+        for q in inputs:
+            self.intern(q)
+            self.dependents.setdefault(q, []).append(p)
+        self._order = None
+        return p
 
     def midpoint(self, a, p) -> Point:
-        self.points[p] = None
         self.midpoints[p] = a
-        return p
+        return self.construct(p, "midpoint", *sorted(a))
+
+    def intersection(self, a, b, p) -> Point:
+        return self.construct(p, "intersection", *sorted(a), *sorted(b))
+
+    def foot(self, p, a, q) -> Point:
+        return self.construct(q, "foot", p, *sorted(a))
 
     def angle(self, p, q, r) -> Angle:
-        theta = (q, frozenset([p, r]))
-        self.angles.add(theta)
-        return theta
+        self._angles.add([self.intern(q), *self.ids([p, r])])
+        return (q, frozenset([p, r]))
 
     def triangle(self, p, q, r) -> Triangle:
-        t = frozenset([p, q, r])
-        self.triangles.add(t)
-        return t
+        self._triangles.add(self.ids([p, q, r]))
+        return frozenset([p, q, r])
 
     def bisector(self, theta) -> Angle:
-        self.bisectors.add(theta)
+        q, a = theta
+        self._bisectors.add([self.intern(q), *self.ids(a)])
         return theta
 
     def perpendicular_bisector(self, a) -> Segment:
-        self.perpendicular_bisectors.add(a)
+        self._perpendicular_bisectors.add(self.ids(a))
         return a
 
+    def segment_ids(self) -> np.ndarray:
+        return self._segments.array()
+
+    def angle_ids(self) -> np.ndarray:
+        return self._angles.array()
+
+    def triangle_ids(self) -> np.ndarray:
+        return self._triangles.array()
+
+    def bisector_ids(self) -> np.ndarray:
+        return self._bisectors.array()
+
+    def perpendicular_bisector_ids(self) -> np.ndarray:
+        return self._perpendicular_bisectors.array()
+
+    # the same things as sets of point names, for small constructions
+
+    @property
+    def segments(self) -> set[Segment]:
+        names = self.names
+        return {frozenset([names[i], names[j]]) for i, j in self.segment_ids().tolist()}
+
+    @property
+    def angles(self) -> set[Angle]:
+        names = self.names
+        return {
+            (names[q], frozenset([names[i], names[j]]))
+            for q, i, j in self.angle_ids().tolist()
+        }
+
+    @property
+    def triangles(self) -> set[Triangle]:
+        names = self.names
+        return {frozenset(names[i] for i in t) for t in self.triangle_ids().tolist()}
+
+    @property
+    def bisectors(self) -> set[Angle]:
+        names = self.names
+        return {
+            (names[q], frozenset([names[i], names[j]]))
+            for q, i, j in self.bisector_ids().tolist()
+        }
+
+    @property
+    def perpendicular_bisectors(self) -> set[Segment]:
+        names = self.names
+        return {
+            frozenset([names[i], names[j]])
+            for i, j in self.perpendicular_bisector_ids().tolist()
+        }
+
+    def order(self) -> dict[Point, int]:
+        # derived points in an order where each comes after all of its inputs,
+        # with their positions in it
+        if self._order is None:
+            order = {}
+            visiting = set()
+
+            def visit(p):
+                if p in order or p not in self.derived:
+                    return
+                if p in visiting:
+                    raise ValueError(f"{p} is derived from itself")
+                visiting.add(p)
+                for q in self.derived[p][1]:
+                    visit(q)
+                visiting.discard(p)
+                order[p] = len(order)
+
+            for p in self.derived:
+                visit(p)
+            self._order = order
+        return self._order
+
+    def resolve(self, pos, moved=None):
+        # computes the positions of the derived points from those of the points
+        # they depend on: all of them, or only the ones downstream of the moved
+        # points; pos holds each point's position at its id
+        ids = self.points
+        order = self.order()
+        if moved is None:
+            todo = list(order)
+        else:
+            seen = set()
+            stack = list(moved)
+            while stack:
+                for p in self.dependents.get(stack.pop(), ()):
+                    if p not in seen:
+                        seen.add(p)
+                        stack.append(p)
+            todo = sorted(seen, key=order.__getitem__)
+        for p in todo:
+            kind, inputs = self.derived[p]
+            pos[ids[p]] = CONSTRUCTIONS[kind](*(pos[ids[q]] for q in inputs))
+
+    def move(self, pos, p, v):
+        pos[self.points[p]] = v
+        self.resolve(pos, [p])
+
+
+# the size of the drawing, and of the box inside it that points are placed in
+CANVAS = 800
+BOX = 700
+
 
 def euclidean(g: Geometry, *, seed):
-    canvas = 800
-    d = dw.Drawing(canvas, canvas)
+    canvas = CANVAS
+    d = drawing(canvas, canvas)
 
     darkpurple = "#8c90c1"
     purple2 = rgb(0.106, 0.122, 0.54)
@@ -78,7 +293,7 @@ def euclidean(g: Geometry, *, seed):
     point_radius = 4
     theta_radius = 30
 
-    dim = 700
+    dim = BOX
     gap = (canvas - dim) / 2
     d.append(
         dw.Rectangle(
@@ -97,50 +312,29 @@ def euclidean(g: Geometry, *, seed):
     )
 
     random.seed(seed)
-    rand = lambda: random.uniform(gap, canvas - gap)
-    pos = {p: vec2(rand(), rand()) for p in g.points.keys()}
-    for p, (q, r) in g.midpoints.items():
-        pos[p] = (pos[q] + pos[r]) / 2
-
-    for p, q, r in g.triangles:
-        d.append(
-            dw.Lines(
-                *pos[p],
-                *pos[q],
-                *pos[r],
-                fill=purple2,
-                fill_opacity=0.2,
-            )
-        )
-
-    def ray(p, t):
-        n = rot90(t)
-        d.append(
-            dw.Line(
-                *p,
-                *(p + t * (ray_length - 5)),
-                stroke_width=stroke_width,
-                stroke=darkpurple,
-            )
-        )
-        d.append(
-            dw.Lines(
-                *(p + t * ray_length),
-                *(p + t * (ray_length - 10) - n * 4),
-                *(p + t * (ray_length - 7)),
-                *(p + t * (ray_length - 10) + n * 4),
-                fill=darkpurple,
-            )
-        )
-
-    for theta in g.angles:
-        q, (p, r) = theta
-        c = pos[q]
-        a = normalize(pos[p] - c)
-        b = normalize(pos[r] - c)
-        x, y = c + a * theta_radius
-        ex, ey = c + b * theta_radius
-
+    names = g.names
+
+    with phase("layout"):
+        rand = lambda: random.uniform(gap, canvas - gap)
+        pos = np.array([(rand(), rand()) for _ in names]).reshape(-1, 2)
+        g.resolve(pos)
+
+    for corners in pos[g.triangle_ids()].reshape(-1, 6).tolist():
+        d.append(dw.Lines(*corners, fill=purple2, fill_opacity=0.2))
+
+    # rays are collected and drawn together at the end so that their arrowheads
+    # can be computed in one batch
+    origins = []
+    directions = []
+
+    angles = g.angle_ids()
+    c, p, r = pos[angles].transpose(1, 0, 2)
+    a = normalize_many(p - c)
+    b = normalize_many(r - c)
+    starts = c + a * theta_radius
+    ends = c + b * theta_radius
+    sweeps = cross(a.T, b.T) > 0
+    for (x, y), (ex, ey), sweep in zip(starts.tolist(), ends.tolist(), sweeps):
         path = dw.Path(fill="none", stroke_width=2, stroke=darkpurple)
         path.M(x, y)
         path.A(
@@ -148,58 +342,81 @@ def euclidean(g: Geometry, *, seed):
             ry=theta_radius,
             rot=0,
             large_arc=False,
-            sweep=cross(a, b) > 0,
+            sweep=bool(sweep),
             ex=ex,
             ey=ey,
         )
         d.append(path)
 
-        if theta in g.bisectors:
-            ray(c, normalize(a + b))
-
-    for p, q in g.perpendicular_bisectors:
-        s = pos[p]
-        v = pos[q] - s
-        m = s + v / 2
-        t = normalize(v)
-        n = rot90(t)
-
-        mark_size = 10
-        u = t * mark_size
-        if random.choice([n[1], -n[1]]) < 0:
-            n = -n
-            u = -u
-
-        d.append(
-            dw.Lines(
-                *(m + n * mark_size),
-                *(m + n * mark_size + u),
-                *(m + u),
-                fill="none",
-                stroke_width=2,
-                stroke="black",
-            )
-        )
-
-        ray(m, n)
-
-    for p, q in g.segments:
-        d.append(dw.Line(*pos[p], *pos[q], stroke="black", stroke_width=stroke_width))
-
-    for p, (x, y) in pos.items():
-        if p in g.midpoints:
+    bisected = contains(angles, g.bisector_ids(), len(names))
+    origins.append(c[bisected])
+    directions.append(normalize_many(a[bisected] + b[bisected]))
+
+    s, q = pos[g.perpendicular_bisector_ids()].transpose(1, 0, 2)
+    v = q - s
+    m = s + v / 2
+    t = normalize_many(v)
+    n = rot90_many(t)
+    mark_size = 10
+    u = t * mark_size
+    for k, y in enumerate(n[:, 1].tolist()):
+        if random.choice([y, -y]) < 0:
+            n[k] = -n[k]
+            u[k] = -u[k]
+    marks = np.stack([m + n * mark_size, m + n * mark_size + u, m + u], axis=1)
+    for corners in marks.reshape(-1, 6).tolist():
+        d.append(dw.Lines(*corners, fill="none", stroke_width=2, stroke="black"))
+    origins.append(m)
+    directions.append(n)
+
+    # everything drawn as a line, for labels to avoid
+    lines = []
+
+    origins = np.concatenate(origins)
+    directions = np.concatenate(directions)
+    if len(origins):
+        ends = origins + directions * (ray_length - 5)
+        heads = arrowheads(
+            origins + directions * ray_length,
+            directions,
+            length=10,
+            half_width=4,
+            notch=7,
+        ).reshape(-1, 8)
+        for p, e, head in zip(origins.tolist(), ends.tolist(), heads.tolist()):
+            d.append(dw.Line(*p, *e, stroke_width=stroke_width, stroke=darkpurple))
+            d.append(dw.Lines(*head, fill=darkpurple))
+        lines.append(np.stack([origins, ends], axis=1))
+
+    segments = pos[g.segment_ids()]
+    for x, y, ex, ey in segments.reshape(-1, 4).tolist():
+        d.append(dw.Line(x, y, ex, ey, stroke="black", stroke_width=stroke_width))
+    lines.append(segments)
+
+    # labels go at these angles unless that would cover something up
+    thetas = [random.uniform(0, tau) for _ in names]
+    with phase("labels"):
+        labels = place_labels(
+            pos,
+            [text_box(p, 35) for p in names],
+            thetas,
+            distance=text_padding,
+            dot=point_radius,
+            segments=np.concatenate(lines),
+            bounds=(gap, gap, canvas - gap, canvas - gap),
+        ).tolist()
+    for p, (x, y), (lx, ly) in zip(names, pos.tolist(), labels):
+        if p in g.derived:
             d.append(dw.Circle(x, y, point_radius, fill="white", stroke="black"))
         else:
             d.append(dw.Circle(x, y, point_radius))
 
-        theta = random.uniform(0, tau)
-        r = text_padding
         d.append(
             dw.Text(
                 p,
                 font_size,
-                x + r * cos(theta),
-                y - r * sin(theta),
+                lx,
+                ly,
                 center=True,
                 font_family="serif",
                 font_style="italic",
@@ -209,6 +426,104 @@ def euclidean(g: Geometry, *, seed):
     return d
 
 
+def score_layouts(g: Geometry, seeds) -> np.ndarray:
+    # how good the layout that euclidean would draw for each seed looks: how
+    # far apart the closest two points, the sides of the smallest angle, and
+    # the closest point and segment it isn't on are, each relative to a
+    # minimum, whichever is worst, minus one for each pair of crossing segments
+    # and each point outside the box
+    gap = (CANVAS - BOX) / 2
+    n = len(g.names)
+
+    # numpy's Mersenne Twister seeded with [seed] draws the same numbers as
+    # random.seed(seed), so these are exactly the placements euclidean makes
+    rng = np.random.RandomState()
+    draws = np.empty((len(seeds), 2 * n))
+    for k, seed in enumerate(seeds):
+        rng.seed([seed])
+        draws[k] = rng.random_sample(2 * n)
+    pts = gap + BOX * draws.T.reshape(n, 2, len(seeds))
+    g.resolve(pts)
+
+    score = np.full(len(seeds), np.inf)
+
+    i, j = np.triu_indices(n, 1)
+    if len(i):
+        apart = np.hypot(*(pts[i] - pts[j]).transpose(1, 0, 2)).min(axis=0)
+        score = np.minimum(score, apart / 100)
+
+    # each corner with its vertex first
+    t = g.triangle_ids()
+    corners = np.concatenate([g.angle_ids(), t, t[:, [1, 2, 0]], t[:, [2, 0, 1]]])
+    if len(corners):
+        v, a, b = corners.T
+        u = pts[a] - pts[v]
+        w = pts[b] - pts[v]
+        dot = u[:, 0] * w[:, 0] + u[:, 1] * w[:, 1]
+        theta = np.arctan2(
+            np.abs(cross(u.transpose(1, 0, 2), w.transpose(1, 0, 2))), dot
+        )
+        score = np.minimum(score, theta.min(axis=0) / (tau / 18))
+
+    lines = np.concatenate([g.segment_ids(), t[:, [0, 1]], t[:, [1, 2]], t[:, [0, 2]]])
+    lines = np.unique(lines, axis=0)
+    if len(lines):
+        s, e = lines.T
+        a = pts[s].transpose(1, 0, 2)
+        b = pts[e].transpose(1, 0, 2)
+
+        # from each point to each segment it isn't on, where its label would
+        # have to fit
+        on = np.zeros((n, len(lines)), dtype=bool)
+        on[s, np.arange(len(lines))] = True
+        on[e, np.arange(len(lines))] = True
+        index = {tuple(line): k for k, line in enumerate(lines.tolist())}
+        for p, (kind, inputs) in g.derived.items():
+            if kind == "foot":
+                inputs = inputs[1:]
+            for q in zip(inputs[::2], inputs[1::2]):
+                k = index.get(tuple(g.ids(q)))
+                if k is not None:
+                    on[g.points[p], k] = True
+        k, m = np.nonzero(~on)
+        if len(k):
+            p = pts[k].transpose(1, 0, 2)
+            u = b[:, m] - a[:, m]
+            w = p - a[:, m]
+            t = np.clip((w[0] * u[0] + w[1] * u[1]) / (u[0] ** 2 + u[1] ** 2), 0, 1)
+            clear = np.hypot(*(w - u * t)).min(axis=0)
+            score = np.minimum(score, clear / 40)
+
+        k, m = np.triu_indices(len(lines), 1)
+        apart = (s[k] != s[m]) & (s[k] != e[m]) & (e[k] != s[m]) & (e[k] != e[m])
+        k, m = k[apart], m[apart]
+        if len(k):
+            u = b[:, k] - a[:, k]
+            v = b[:, m] - a[:, m]
+            crosses = (
+                cross(u, a[:, m] - a[:, k]) * cross(u, b[:, m] - a[:, k]) < 0
+            ) & (cross(v, a[:, k] - a[:, m]) * cross(v, b[:, k] - a[:, m]) < 0)
+            score -= crosses.sum(axis=0)
+
+    outside = (pts < gap) | (pts > CANVAS - gap)
+    score -= outside.any(axis=1).sum(axis=0)
+    return score
+
+
+def search_layout(g: Geometry, n_candidates=10000, jobs=None, *, start=0) -> int:
+    # the best of the seeds from start on for euclidean to draw g with, scoring
+    # them in chunks spread across processes
+    seeds = np.arange(start, start + n_candidates)
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1:
+        scores = score_layouts(g, seeds)
+    else:
+        chunks = np.array_split(seeds, 4 * jobs)
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            scores = np.concatenate(list(pool.map(score_layouts, repeat(g), chunks)))
+    return int(seeds[np.argmax(scores)])
+
+
 def draw():
     g = Geometry()
     p = g.point("p")
@@ -1,14 +1,28 @@
 import random
 from itertools import pairwise
-from math import cos, sin, tau
+from math import tau
 
 import drawsvg as dw
-import networkx as nx
 
-from diagram import normalize, rot90
+import cache
+import cycles
+import layout
+from diagram import (
+    arrowheads,
+    drawing,
+    lazy,
+    midpoints,
+    normalize_many,
+    phase,
+    place_labels,
+    text_box,
+)
 
+np = lazy("numpy")
+nx = lazy("networkx")
 
-def hamiltonian(nodes, other, *, seed):
+
+def hamiltonian(nodes, other, *, seed, engine="auto"):
     red_orange = "#FE4A49"
 
     graph = nx.DiGraph()
@@ -16,42 +30,61 @@ def hamiltonian(nodes, other, *, seed):
     graph.add_edges_from(other)
     graph.add_edges_from(pairwise(nodes), color=red_orange)
     graph.add_edge(nodes[-1], nodes[0], color=red_orange)
-    pos = nx.spring_layout(graph, scale=150, center=[200, 200], seed=seed)
-
-    d = dw.Drawing(400, 400)
+    # a name from layout.ENGINES, or a function with the same signature
+    place = layout.ENGINES[engine] if isinstance(engine, str) else engine
+    kwargs = dict(scale=150, center=(200, 200), seed=seed)
+    with phase("layout"):
+        if isinstance(engine, str):
+            # only the layout engines themselves can change their result, so
+            # tweaking the rest of this file doesn't have to redo the layout
+            inputs = [engine, list(graph), list(graph.edges), kwargs]
+            pos = cache.layout(
+                "hamiltonian",
+                inputs,
+                lambda: {"pos": place(graph, nodes, **kwargs)},
+                sources=["layout"],
+            )["pos"]
+        else:
+            pos = place(graph, nodes, **kwargs)
+    index = {v: i for i, v in enumerate(graph)}
 
-    for u, v, data in graph.edges.data():
-        color = data.get("color", "black")
+    d = drawing(400, 400)
 
-        a = pos[u]
-        b = pos[v]
-        d.append(dw.Line(*a, *b, stroke=color))
-
-        t = normalize(b - a)
-        n = rot90(t)
-        m = (a + b) / 2
-        x = 6
-        y = 4
-        d.append(
-            dw.Lines(
-                *(m - x * t + y * n), *(m + x * t), *(m - x * t - y * n), fill=color
-            )
-        )
+    edges = list(graph.edges.data("color", default="black"))
+    a = pos[[index[u] for u, _, _ in edges]]
+    b = pos[[index[v] for _, v, _ in edges]]
+    t = normalize_many(b - a)
+    heads = arrowheads(midpoints(a, b) + 6 * t, t, length=12, half_width=4)
+    for (_, _, color), p, q, head in zip(
+        edges, a.tolist(), b.tolist(), heads.reshape(-1, 6).tolist()
+    ):
+        d.append(dw.Line(*p, *q, stroke=color))
+        d.append(dw.Lines(*head, fill=color))
 
     random.seed(seed)
 
-    for v, [x, y] in pos.items():
+    # labels go at these angles unless that would cover something up
+    thetas = [random.uniform(0, tau) for _ in graph]
+    with phase("labels"):
+        labels = place_labels(
+            pos,
+            [text_box(str(v), 18) for v in graph],
+            thetas,
+            distance=15,
+            dot=5,
+            segments=np.stack([a, b], axis=1),
+            bounds=(0, 0, 400, 400),
+        ).tolist()
+    for v, (x, y), (lx, ly) in zip(graph, pos.tolist(), labels):
         fill = red_orange if v == nodes[0] else "black"
         d.append(dw.Circle(x, y, 5, fill=fill))
 
-        theta = random.uniform(0, tau)
-        r = 15
         d.append(
             dw.Text(
-                v,
+                str(v),
                 "18px",
-                x + r * cos(theta),
-                y - r * sin(theta),
+                lx,
+                ly,
                 center=True,
                 font_family="serif",
                 fill=fill,
@@ -64,6 +97,19 @@ def hamiltonian(nodes, other, *, seed):
     return d
 
 
+def hamiltonian_graph(graph, *, seed, engine="auto", budget=10.0):
+    # the same diagram for any networkx graph that has a Hamiltonian cycle,
+    # found by searching for at most budget seconds
+    cycle = cycles.hamiltonian_cycle(graph, budget=budget)
+    if cycle is None:
+        raise ValueError("graph has no Hamiltonian cycle")
+    on = set(pairwise(cycle + cycle[:1]))
+    if not graph.is_directed():
+        on |= {(v, u) for u, v in on}
+    other = [(u, v) for u, v in graph.edges if (u, v) not in on]
+    return hamiltonian(cycle, other, seed=seed, engine=engine)
+
+
 def draw():
     return hamiltonian(
         ["a", "b", "c", "d", "e", "f", "g"],
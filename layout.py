@@ -0,0 +1,176 @@
+import functools
+from math import ceil, log2, sqrt, tau
+
+from diagram import lazy
+
+np = lazy("numpy")
+nx = lazy("networkx")
+
+# Each engine takes a graph and one of its Hamiltonian cycles as a list of nodes,
+# and returns an (N, 2) array with the position of each node in graph order.
+
+
+def rescale(pos, scale, center):
+    # the same normalization as networkx applies to its own layouts
+    pos = pos - pos.mean(axis=0)
+    lim = np.abs(pos).max()
+    if lim > 0:
+        pos *= scale / lim
+    return pos + center
+
+
+def spring(graph, cycle, *, scale, center, seed):
+    layout = nx.spring_layout(graph, scale=scale, center=list(center), seed=seed)
+    return np.array(list(layout.values()))
+
+
+def circular(graph, cycle, *, scale, center, seed):
+    index = {v: i for i, v in enumerate(graph)}
+    thetas = tau * np.arange(len(cycle)) / len(cycle)
+    pos = np.empty((len(graph), 2))
+    pos[[index[v] for v in cycle]] = np.stack([np.cos(thetas), np.sin(thetas)], axis=1)
+    return pos * scale + center
+
+
+@functools.cache
+def far_cells(level):
+    # for each cell of a 2**level square grid, the 36 children of its parent's
+    # neighbors, with the ones next to the cell itself or outside the grid
+    # replaced by an extra cell past the end
+    m = 2**level
+    cx, cy = np.divmod(np.arange(m * m), m)
+    ox, oy = np.divmod(np.arange(36), 6)
+    x = (cx[:, None] >> 1) * 2 + ox - 2
+    y = (cy[:, None] >> 1) * 2 + oy - 2
+    far = (np.abs(x - cx[:, None]) > 1) | (np.abs(y - cy[:, None]) > 1)
+    ok = far & (x >= 0) & (x < m) & (y >= 0) & (y < m)
+    return np.where(ok, x * m + y, m * m)
+
+
+@functools.cache
+def near_cells(level):
+    # for each cell of a 2**level square grid, itself and its 8 neighbors, with
+    # the ones outside the grid replaced by an extra cell past the end
+    m = 2**level
+    cx, cy = np.divmod(np.arange(m * m), m)
+    ox, oy = np.divmod(np.arange(9), 3)
+    x = cx[:, None] + ox - 1
+    y = cy[:, None] + oy - 1
+    ok = (x >= 0) & (x < m) & (y >= 0) & (y < m)
+    return np.where(ok, x * m + y, m * m)
+
+
+def repulsion(pos, k):
+    # Fruchterman-Reingold repulsion between every pair of nodes, approximated
+    # with a quadtree as in Barnes-Hut: at each level, the cells next to a
+    # node's parent cell but not next to its own cell are far enough away to
+    # act as single bodies at their centroids, and only the nodes in the
+    # neighboring cells at the finest level are visited one by one
+    n = len(pos)
+    levels = max(0, ceil(log2(n / 4) / 2))
+    side = 2**levels
+    lo = pos.min(axis=0)
+    extent = max((pos.max(axis=0) - lo).max(), 1e-12)
+    cell = np.minimum(((pos - lo) / extent * side).astype(int), side - 1)
+    disp = np.zeros_like(pos)
+
+    x, y = pos.T
+    for level in range(2, levels + 1):
+        m = 2**level
+        flat = (cell[:, 0] >> (levels - level)) * m + (cell[:, 1] >> (levels - level))
+        # one extra cell with no mass, for the neighbors that fall off the edge
+        mass = np.bincount(flat, minlength=m * m + 1).astype(float)
+        cx = np.bincount(flat, x, minlength=m * m + 1) / np.maximum(mass, 1)
+        cy = np.bincount(flat, y, minlength=m * m + 1) / np.maximum(mass, 1)
+        f = far_cells(level)[flat]
+        dx = x[:, None] - cx[f]
+        dy = y[:, None] - cy[f]
+        w = k * k * mass[f] / np.maximum(dx * dx + dy * dy, 1e-4)
+        disp[:, 0] += np.einsum("ij,ij->i", dx, w)
+        disp[:, 1] += np.einsum("ij,ij->i", dy, w)
+
+    # every node paired with every other node in the cells around its own
+    flat = cell[:, 0] * side + cell[:, 1]
+    members = np.argsort(flat, kind="stable")
+    count = np.bincount(flat, minlength=side * side + 1)
+    start = np.cumsum(count) - count
+    f = near_cells(levels)[flat].ravel()
+    size = count[f]
+    i = np.repeat(np.repeat(np.arange(n), 9), size)
+    # where each pair's second node is among the members of its cell
+    nth = np.arange(len(i)) - np.repeat(np.cumsum(size) - size, size)
+    j = members[np.repeat(start[f], size) + nth]
+    i, j = i[i != j], j[i != j]
+    dx = x[i] - x[j]
+    dy = y[i] - y[j]
+    w = k * k / np.maximum(dx * dx + dy * dy, 1e-4)
+    disp[:, 0] += np.bincount(i, dx * w, minlength=n)
+    disp[:, 1] += np.bincount(i, dy * w, minlength=n)
+
+    return disp
+
+
+def barnes_hut(
+    graph,
+    cycle,
+    *,
+    scale,
+    center,
+    seed,
+    iterations=50,
+    threshold=1e-4,
+    start="random",
+):
+    # the same force model and cooling schedule as networkx's spring layout, but
+    # with approximate repulsion so that each iteration is O(N log N); it stops
+    # after the given number of iterations, or earlier once the average step
+    # falls below the threshold
+    index = {v: i for i, v in enumerate(graph)}
+    n = len(index)
+    edges = np.array(
+        [(index[u], index[v]) for u, v in graph.edges()], dtype=int
+    ).reshape(-1, 2)
+
+    rng = np.random.default_rng(seed)
+    if start == "cycle":
+        pos = circular(graph, cycle, scale=0.5, center=(0.5, 0.5), seed=seed)
+        pos += rng.normal(scale=1e-3, size=pos.shape)
+    else:
+        pos = rng.random((n, 2))
+
+    k = 1 / sqrt(n)
+    t = max(np.ptp(pos, axis=0).max() * 0.1, 1e-4)
+    dt = t / (iterations + 1)
+    for _ in range(iterations):
+        disp = repulsion(pos, k)
+
+        delta = pos[edges[:, 0]] - pos[edges[:, 1]]
+        d = np.maximum(np.sqrt(np.einsum("ij,ij->i", delta, delta)), 0.01)
+        pull = delta * (d / k)[:, None]
+        for axis in range(2):
+            disp[:, axis] -= np.bincount(edges[:, 0], pull[:, axis], minlength=n)
+            disp[:, axis] += np.bincount(edges[:, 1], pull[:, axis], minlength=n)
+
+        length = np.sqrt(np.einsum("ij,ij->i", disp, disp))
+        length = np.where(length < 0.01, 0.1, length)
+        step = disp * (t / length)[:, None]
+        pos += step
+        t -= dt
+        if np.linalg.norm(step) / n < threshold:
+            break
+
+    return rescale(pos, scale, center)
+
+
+def auto(graph, cycle, **kwargs):
+    # networkx's layout for the small graphs it handles well
+    engine = spring if len(graph) <= 500 else barnes_hut
+    return engine(graph, cycle, **kwargs)
+
+
+ENGINES = {
+    "auto": auto,
+    "spring": spring,
+    "circular": circular,
+    "barnes_hut": barnes_hut,
+}
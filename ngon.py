@@ -1,20 +1,18 @@
-from math import cos, pi, sin, tau
+import functools
+from math import cos, pi, tau
 
 import drawsvg as dw
 
-from diagram import normalize, vec2
+from diagram import drawing, lazy, normalize_many, vec2
 
+np = lazy("numpy")
 
-def penrose(
-    path: dw.Path,
-    *,
-    center,
-    radius=50,
-    hole_size=0.35,
-    angle=0,
-    n_sides=5,
-    chirality="ccw",
-):
+
+# the diagram draws 13 shapes, so this holds all of them without keeping every
+# shape ever drawn by a long-running process
+@functools.lru_cache(maxsize=32)
+def penrose_data(center, radius, hole_size, angle, n_sides, chirality) -> str:
+    # the path data that penrose() adds, computed once for each shape
     n = n_sides
     assert isinstance(n, int) and n >= 3
     R = radius  # shorthand for outer radius
@@ -24,48 +22,48 @@ def penrose(
     s = 1 if chirality == "cw" else -1
 
     # inner and outer polygons
-    a = []
-    b = []
-    for k in range(n):
-        theta = angle + (k * tau) / n
-        p = vec2(s * sin(theta), -cos(theta))
-        a.append(center + r * p)
-        b.append(center + R * p)
-
-    # unit edge vectors
-    u = []
-    for i in range(n):
-        j = (i + 1) % n
-        u.append(normalize(a[j] - a[i]))
+    theta = angle + np.arange(n) * tau / n
+    p = np.stack([s * np.sin(theta), -np.cos(theta)], axis=1)
+    a = np.add(center, r * p)
+    b = np.add(center, R * p)
 
-    # inner and outer midpoints
-    c = []
-    d = []
-    for i in range(n):
-        l = (i - 1 + n) % n
-        c.append(a[i] - w * u[i])
-        d.append(b[i] - w * u[l])
+    # unit edge vectors, from each vertex to the next
+    u = normalize_many(np.roll(a, -1, axis=0) - a)
 
-    # add polygons to path
-    for i in range(n):
-        j = (i + 1) % n
-        k = (i + 2) % n
+    # inner and outer midpoints
+    c = a - w * u
+    d = b - w * np.roll(u, 1, axis=0)
+
+    # one polygon per side, each ending with the next side's inner corner
+    i = np.arange(n)
+    j = (i + 1) % n
+    k = (i + 2) % n
+    polygons = np.stack([d[i], b[i], d[j], c[k], a[k], c[j]], axis=1)
+    return " ".join(
+        "M{},{} L{},{} L{},{} L{},{} L{},{} L{},{} Z".format(*xy)
+        for xy in polygons.reshape(n, 12).tolist()
+    )
 
-        path.M(*d[i])
-        path.L(*b[i])
-        path.L(*d[j])
-        path.L(*c[k])
-        path.L(*a[k])
-        path.L(*c[j])
-        path.Z()
 
-    return path
+def penrose(
+    path: dw.Path,
+    *,
+    center,
+    radius=50,
+    hole_size=0.35,
+    angle=0,
+    n_sides=5,
+    chirality="ccw",
+):
+    return path.append(
+        penrose_data(tuple(center), radius, hole_size, angle, n_sides, chirality)
+    )
 
 
 def draw():
     width = 1920
     height = 1080
-    d = dw.Drawing(width, height)
+    d = drawing(width, height)
 
     background = dw.RadialGradient(cx=960, cy=540, r=1352.8455844)
     background.add_stop(0.1477348, "gray")
@@ -73,54 +71,48 @@ def draw():
     d.append(dw.Rectangle(0, 0, width, height, fill=background))
 
     mask = dw.ClipPath()
-    glows = dw.Group(clip_path=mask)
+    glows = d.group(clip_path=mask)
 
     for j in range(3):
         for i in range(4):
             n = max(3, 1 + j * 4 + i)
             center = vec2(width / 2 + 400 * (i - 1.5), height / 2 - 350 * (j - 1))
 
+            # the outline and its glow are the same shape, so it's only written
+            # out once and then referenced by both
+            shape = penrose(
+                dw.Path(), center=center, radius=150, hole_size=0.5, n_sides=n
+            )
             d.append(
-                penrose(
-                    dw.Path(
-                        fill="none",
-                        stroke="#888",
-                        stroke_width=5,
-                        stroke_linejoin="round",
-                    ),
-                    center=center,
-                    radius=150,
-                    hole_size=0.5,
-                    n_sides=n,
+                dw.Use(
+                    shape,
+                    0,
+                    0,
+                    fill="none",
+                    stroke="#888",
+                    stroke_width=5,
+                    stroke_linejoin="round",
                 )
             )
-
             glows.append(
-                penrose(
-                    dw.Path(
-                        fill="none",
-                        stroke="#fffb",
-                        stroke_width=5,
-                        style="filter:blur(10px);",
-                    ),
-                    center=center,
-                    radius=150,
-                    hole_size=0.5,
-                    n_sides=n,
+                dw.Use(
+                    shape,
+                    0,
+                    0,
+                    fill="none",
+                    stroke="#fffb",
+                    stroke_width=5,
+                    style="filter:blur(10px);",
                 )
             )
 
     c = vec2(width / 2, height / 2 - 60)
     R = 350
 
-    logo = lambda: penrose(
-        dw.Path(fill="#3fb4f7bb", stroke="#555", stroke_width=6),
-        center=c,
-        radius=R,
-    )
+    logo = penrose(dw.Path(), center=c, radius=R)
 
-    icon = dw.Group(style="filter: drop-shadow(0px 50px 20px #0008);")
-    icon.append(logo())
+    icon = d.group(style="filter: drop-shadow(0px 50px 20px #0008);")
+    icon.append(dw.Use(logo, 0, 0, fill="#3fb4f7bb", stroke="#555", stroke_width=6))
     icon.append(
         dw.Text(
             "Penrose",
@@ -136,7 +128,7 @@ def draw():
     )
     d.append(icon)
 
-    mask.append(logo())
+    mask.append(dw.Use(logo, 0, 0))
     d.append(glows)
 
     return d
@@ -1,16 +1,131 @@
+from __future__ import annotations
+
+import struct
+import zlib
 from typing import Any, Callable
 
 import drawsvg as dw
-from sympy import Quaternion
 
-from diagram import rgb
+from diagram import drawing, lazy, phase, rgb
+
+np = lazy("numpy")
+sympy = lazy("sympy")
+
+
+def coefficients(group) -> np.ndarray | None:
+    # an (N, 4) array of the real coefficients of each quaternion in the group,
+    # or None if some element isn't a quaternion with numeric coefficients
+    try:
+        return np.array(
+            [[float(g.a), float(g.b), float(g.c), float(g.d)] for g in group]
+        ).reshape(-1, 4)
+    except (AttributeError, TypeError):
+        return None
+
+
+def hamilton(p: np.ndarray, q: np.ndarray) -> np.ndarray:
+    # the products of quaternions given as (..., 4) arrays of coefficients
+    a1, b1, c1, d1 = np.moveaxis(p, -1, 0)
+    a2, b2, c2, d2 = np.moveaxis(q, -1, 0)
+    return np.stack(
+        [
+            a1 * a2 - b1 * b2 - c1 * c2 - d1 * d2,
+            a1 * b2 + b1 * a2 + c1 * d2 - d1 * c2,
+            a1 * c2 - b1 * d2 + c1 * a2 + d1 * b2,
+            a1 * d2 + b1 * c2 - c1 * b2 + d1 * a2,
+        ],
+        axis=-1,
+    )
+
+
+def lookup(elements: np.ndarray, products: np.ndarray) -> np.ndarray:
+    # the index of the row of elements equal to each row of products, or -1
+    # where there isn't one, comparing rows by their bytes
+    def keys(rows):
+        rows = np.ascontiguousarray(rows)
+        return rows.view(np.dtype((np.void, rows.itemsize * rows.shape[1]))).ravel()
+
+    elements = keys(elements)
+    products = keys(products)
+    order = np.argsort(elements, kind="stable")
+    found = np.searchsorted(elements[order], products)
+    found = np.minimum(found, len(order) - 1)
+    return np.where(elements[order][found] == products, order[found], -1)
+
+
+def compose(perms: np.ndarray) -> np.ndarray:
+    # the multiplication table of a group of permutations, each given as the
+    # images of 0 through K - 1 in a row of an (N, K) array, where the product
+    # of p and q sends i to p[q[i]]
+    n, k = perms.shape
+    return lookup(perms, perms[:, perms].reshape(-1, k)).reshape(n, n)
+
+
+def multiplication_table(group) -> np.ndarray:
+    # an (N, N) array with the index in the group of the product of the
+    # elements at each pair of indices, or -1 where it isn't in the group
+    if isinstance(group, np.ndarray) and np.issubdtype(group.dtype, np.integer):
+        return compose(group)
+
+    n = len(group)
+    coeffs = coefficients(group)
+    if coeffs is None:
+        index = {g: m for m, g in enumerate(group)}
+        return np.array(
+            [[index.get(b * c, -1) for c in group] for b in group], dtype=int
+        ).reshape(n, n)
+
+    # match products to elements by their coefficients, rounded so that
+    # irrational ones still compare equal, and with -0.0 turned into 0.0
+    products = hamilton(coeffs[:, None], coeffs[None, :]).reshape(-1, 4)
+    rows = np.round(np.concatenate([coeffs, products]), 9) + 0.0
+    return lookup(rows[:n], rows[n:]).reshape(n, n)
 
 
-def cayley_table(group, *, texify: Callable[[Any], str]):
-    d = dw.Drawing(220, 220)
+# groups with more elements than this are drawn without any text, which would
+# be too small to read, and as runs of cells of the same color instead of one
+# cell at a time, or as an image if there are more runs than the run limit
+TEXT_LIMIT = 24
+RUN_LIMIT = 10000
 
-    def equation(g, x, y, **kwargs):
-        s = texify(g)
+
+def png(pixels: np.ndarray, palette: np.ndarray | None = None) -> bytes:
+    # an (H, W) array of indices into an (N, 4) RGBA palette of at most 256
+    # colors, or an (H, W, 4) array of RGBA colors, encoded as a PNG
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        body = kind + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body))
+
+    pixels = np.asarray(pixels, dtype=np.uint8)
+    height, width = pixels.shape[:2]
+    color = 6 if palette is None else 3
+    header = struct.pack(">IIBBBBB", width, height, 8, color, 0, 0, 0)
+    # each row starts with the number of the filter it uses, 0 for none
+    rows = np.concatenate(
+        [np.zeros((height, 1), dtype=np.uint8), pixels.reshape(height, -1)], axis=1
+    )
+    chunks = [chunk(b"IHDR", header)]
+    if palette is not None:
+        palette = np.asarray(palette, dtype=np.uint8)
+        chunks.append(chunk(b"PLTE", palette[:, :3].tobytes()))
+        chunks.append(chunk(b"tRNS", palette[:, 3].tobytes()))
+    chunks.append(chunk(b"IDAT", zlib.compress(rows.tobytes(), 9)))
+    chunks.append(chunk(b"IEND", b""))
+    return b"\x89PNG\r\n\x1a\n" + b"".join(chunks)
+
+
+def cayley_table(
+    group, *, texify: Callable[[Any], str], table=None, mode: str | None = None
+):
+    # The group can be a list of elements to multiply, or an integer array of
+    # permutations, one per row; or the product of the elements at each pair
+    # of indices can be given as a table. The cells are drawn one by one, in
+    # "cells" mode; as one path per color, with each run of cells of the same
+    # color in a row merged, in "runs" mode; or as a single image with a pixel
+    # for each cell, in "image" mode.
+    d = drawing(220, 220)
+
+    def equation(s, x, y, **kwargs):
         d.append(
             dw.Text(
                 s,
@@ -29,35 +144,46 @@ def cayley_table(group, *, texify: Callable[[Any], str]):
     table_width = 180
     table_height = 180
 
-    box_padding = 2
-
     n = len(group)
     w = table_width / n
     h = table_height / n
+    box_padding = min(2, w / 4)
 
-    box_colors = {}
-    label_colors = {}
+    if table is None:
+        with phase("table"):
+            table = multiplication_table(group)
+    table = np.asarray(table)
+    if mode is None and n <= TEXT_LIMIT:
+        mode = "cells"
+    if mode not in [None, "cells", "runs", "image"]:
+        raise ValueError(f"Unknown mode {mode!r}")
+    # every label is of an element of the group, so each is only made once
+    texts = [texify(g) for g in group] if n <= TEXT_LIMIT else None
 
-    for m, g in enumerate(group):
+    box_colors = []
+    label_colors = []
+
+    for m in range(n):
         t = 0.1 + 0.8 * (1 - (m + 1) / n)
         s = max(0, min(1, t))
         red = 1 - (1 - max(0, min(1, 3 * t))) ** 2
         green = 3 * s * s - 2 * s * s * s
         blue = max(0, min(1, 3 * t - 2))
-        box_colors[g] = rgb(red, green, blue)
-        label_colors[g] = rgb(0.75 * red, 0.75 * green, 0.75 * blue)
+        box_colors.append(rgb(red, green, blue))
+        label_colors.append(rgb(0.75 * red, 0.75 * green, 0.75 * blue))
 
-        u = (m + 1.5) * w
-        v = (m + 1.5) * h
-        equation(g, w / 2, v, fill=dark_gray)
-        equation(g, u, h / 2, fill=dark_gray)
+        if texts is not None:
+            u = (m + 1.5) * w
+            v = (m + 1.5) * h
+            equation(texts[m], w / 2, v, fill=dark_gray)
+            equation(texts[m], u, h / 2, fill=dark_gray)
 
-    for x, b in enumerate(group):
-        for y, c in enumerate(group):
-            a = b * c
+    if mode == "cells":
+        for x, column in enumerate(table.tolist()):
+            for y, a in enumerate(column):
+                if a < 0:
+                    continue
 
-            box = box_colors.get(a)
-            if box is not None:
                 d.append(
                     dw.Rectangle(
                         (x + 1) * w + box_padding / 2,
@@ -65,15 +191,74 @@ def cayley_table(group, *, texify: Callable[[Any], str]):
                         w - box_padding,
                         h - box_padding,
                         rx=2,
-                        fill=box,
+                        fill=box_colors[a],
                         fill_opacity=0.75,
                     )
                 )
+                if texts is not None:
+                    equation(
+                        texts[a], (x + 1.5) * w, (y + 1.5) * h, fill=label_colors[a]
+                    )
+        return d
 
-            label = label_colors.get(a)
-            if label is not None:
-                equation(a, (x + 1.5) * w, (y + 1.5) * h, fill=label)
+    # elements that happen to get the same color are drawn the same, with an
+    # extra transparent color at the end for products outside the group
+    colors, color = np.unique(box_colors, return_inverse=True)
+    cells = np.where(table.T >= 0, color.reshape(-1)[table.T], len(colors))
 
+    # each run starts at the start of a row or a change of color, and goes on
+    # until the next one starts
+    starts = np.ones(cells.shape, dtype=bool)
+    starts[:, 1:] = cells[:, 1:] != cells[:, :-1]
+    y, x = np.nonzero(starts)
+    if mode is None:
+        mode = "runs" if len(y) <= RUN_LIMIT else "image"
+
+    if mode == "image":
+        palette = [(*bytes.fromhex(c[1:]), 255) for c in colors.tolist()]
+        palette.append((0, 0, 0, 0))
+        if len(palette) <= 256:
+            pixels = png(cells, palette)
+        else:
+            pixels = png(np.array(palette, dtype=np.uint8)[cells])
+        d.append(
+            dw.Image(
+                w,
+                h,
+                table_width,
+                table_height,
+                data=pixels,
+                embed=True,
+                mime_type="image/png",
+                opacity=0.75,
+                preserveAspectRatio="none",
+                style="image-rendering:pixelated",
+            )
+        )
+        return d
+
+    flat = y * n + x
+    length = np.diff(np.append(flat, n * n))
+    c = cells[y, x]
+    keep = c < len(colors)
+    y, x, length, c = y[keep], x[keep], length[keep], c[keep]
+
+    left = (x + 1) * w + box_padding / 2
+    top = (y + 1) * h + box_padding / 2
+    width = length * w - box_padding
+    order = np.argsort(c, kind="stable")
+    bounds = np.searchsorted(c[order], np.arange(len(colors) + 1))
+    rows = np.stack([left, top, width, -width], axis=1).round(3).tolist()
+    height = round(h - box_padding, 3)
+    for k, fill in enumerate(colors.tolist()):
+        runs = order[bounds[k] : bounds[k + 1]]
+        if not len(runs):
+            continue
+        path = " ".join(
+            f"M{x0},{y0} h{dx} v{height} h{back} Z"
+            for x0, y0, dx, back in map(rows.__getitem__, runs.tolist())
+        )
+        d.append(dw.Path(path, fill=fill, fill_opacity=0.75))
     return d
 
 
@@ -98,8 +283,8 @@ def short(g):
 
 
 def draw():
-    one = Quaternion(1)
-    i = Quaternion(0, 1)
-    j = Quaternion(0, 0, 1)
-    k = Quaternion(0, 0, 0, 1)
+    one = sympy.Quaternion(1)
+    i = sympy.Quaternion(0, 1)
+    j = sympy.Quaternion(0, 0, 1)
+    k = sympy.Quaternion(0, 0, 0, 1)
     return cayley_table([one, i, j, k, -one, -i, -j, -k], texify=short)
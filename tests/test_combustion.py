@@ -0,0 +1,150 @@
+import drawsvg as dw
+import numpy as np
+import pytest
+
+import combustion
+from benchmarks.scaled import molecule
+
+COLORS = {"white": (255, 255, 255), "black": (0, 0, 0), "red": (255, 0, 0)}
+
+
+def color(value):
+    if value in COLORS:
+        return COLORS[value]
+    return tuple(int(value[k : k + 2], 16) for k in (1, 3, 5))
+
+
+def segments(data):
+    # the straight segments of a path made of M, L and Z commands
+    points = []
+    for command in data.split():
+        if command == "Z":
+            points[-1].append(points[-1][0])
+            continue
+        x, y = map(float, command[1:].split(","))
+        if command[0] == "M":
+            points.append([])
+        points[-1].append((x, y))
+    return [(a, b) for line in points for a, b in zip(line, line[1:])]
+
+
+def rasterize(d, width, height) -> np.ndarray:
+    # the color at the center of each pixel, from the circles, ellipses and
+    # round-capped lines in the drawing, which is all its scene is made of
+    image = np.full((height, width, 3), 255, dtype=np.uint8)
+
+    def paint(x0, y0, x1, y1, inside, value):
+        if value in (None, "none"):
+            return
+        x0, y0 = max(int(x0), 0), max(int(y0), 0)
+        x1, y1 = min(int(x1) + 2, width), min(int(y1) + 2, height)
+        if x0 >= x1 or y0 >= y1:
+            return
+        y, x = np.mgrid[y0:y1, x0:x1] + 0.5
+        image[y0:y1, x0:x1][inside(x, y)] = color(value)
+
+    def draw(element, style):
+        style = {**style, **element.args}
+        if isinstance(element, dw.Group):
+            for child in element.children:
+                draw(child, style)
+            return
+        fill, stroke = style.get("fill"), style.get("stroke")
+        w = float(style.get("stroke-width", 1)) / 2
+        if isinstance(element, (dw.Circle, dw.Ellipse)):
+            cx, cy = float(style["cx"]), float(style["cy"])
+            rx = float(style.get("rx", style.get("r")))
+            ry = float(style.get("ry", style.get("r")))
+            ext = max(rx, ry) + w
+
+            def level(x, y):
+                return np.hypot((x - cx) / rx, (y - cy) / ry) * min(rx, ry)
+
+            box = cx - ext, cy - ext, cx + ext, cy + ext
+            paint(*box, lambda x, y: level(x, y) <= min(rx, ry), fill)
+            paint(*box, lambda x, y: abs(level(x, y) - min(rx, ry)) <= w, stroke)
+        elif isinstance(element, dw.Path):
+            for (ax, ay), (bx, by) in segments(style["d"]):
+
+                def near(x, y):
+                    dx, dy = bx - ax, by - ay
+                    t = ((x - ax) * dx + (y - ay) * dy) / max(dx * dx + dy * dy, 1e-12)
+                    t = np.clip(t, 0, 1)
+                    return np.hypot(ax + t * dx - x, ay + t * dy - y) <= w
+
+                box = min(ax, bx) - w, min(ay, by) - w, max(ax, bx) + w, max(ay, by) + w
+                paint(*box, near, stroke)
+
+    for element in d.elements:
+        draw(element, {})
+    return image
+
+
+def elements(d):
+    def walk(e):
+        yield e
+        for child in getattr(e, "children", ()):
+            yield from walk(child)
+
+    for e in d.elements:
+        yield from walk(e)
+
+
+def crossings(lines) -> int:
+    # how many pairs of the segments cross each other
+    a, b = lines[:, None, 0], lines[:, None, 1]
+    c, d = lines[None, :, 0], lines[None, :, 1]
+
+    def side(p, q, r):
+        u, v = q - p, r - p
+        return u[..., 0] * v[..., 1] - u[..., 1] * v[..., 0]
+
+    crossed = (side(a, b, c) * side(a, b, d) < 0) & (side(c, d, a) * side(c, d, b) < 0)
+    return int(crossed.sum()) // 2
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_merged_bonds_look_the_same(seed):
+    m = molecule(200)
+    drawings = [
+        combustion.reaction(
+            title="",
+            reactants=[m, m],
+            products=[m],
+            seed=seed,
+            merge_bonds=merge_bonds,
+            cull=False,
+        )
+        for merge_bonds in [False, True]
+    ]
+    unmerged, merged = (rasterize(d, d.width, d.height) for d in drawings)
+
+    lines = np.array(
+        [
+            line
+            for e in elements(drawings[0])
+            if isinstance(e, dw.Path)
+            for line in segments(e.args["d"])
+        ]
+    )
+    assert crossings(lines) > 0
+    paths = [sum(isinstance(e, dw.Path) for e in elements(d)) for d in drawings]
+    assert paths[1] < paths[0]
+
+    different = np.any(unmerged != merged, axis=2)
+    assert not different.any(), f"{different.sum()} pixels differ"
+
+
+def test_culled_looks_the_same():
+    m = molecule(200)
+    drawings = [
+        combustion.reaction(title="", reactants=[m, m], products=[m], seed=0, cull=cull)
+        for cull in [False, True]
+    ]
+    unculled, culled = (rasterize(d, d.width, d.height) for d in drawings)
+
+    counts = [sum(1 for _ in elements(d)) for d in drawings]
+    assert counts[1] < counts[0]
+
+    different = np.any(unculled != culled, axis=2)
+    assert not different.any(), f"{different.sum()} pixels differ"
@@ -0,0 +1,66 @@
+import random
+
+import networkx as nx
+import pytest
+
+import cycles
+
+
+def masks(n, edges, directed):
+    succ = [0] * n
+    pred = [0] * n
+    for u, v in edges:
+        succ[u] |= 1 << v
+        pred[v] |= 1 << u
+        if not directed:
+            succ[v] |= 1 << u
+            pred[u] |= 1 << v
+    return succ, pred
+
+
+def random_graph(rng, directed):
+    n = rng.randint(3, 9)
+    p = rng.uniform(0.2, 0.7)
+    edges = [
+        (u, v)
+        for u in range(n)
+        for v in range(n)
+        if u != v and (directed or u < v) and rng.random() < p
+    ]
+    return n, edges
+
+
+def check(cycle, n, edges, directed):
+    # a cycle visits every node once, starting from node 0, using real edges
+    assert sorted(cycle) == list(range(n))
+    assert cycle[0] == 0
+    edges = set(edges)
+    for u, v in zip(cycle, cycle[1:] + cycle[:1]):
+        assert (u, v) in edges or (not directed and (v, u) in edges)
+
+
+@pytest.mark.parametrize("directed", [False, True])
+def test_dp_agrees_with_search(directed):
+    rng = random.Random(0)
+    found = 0
+    for _ in range(300):
+        n, edges = random_graph(rng, directed)
+        succ, pred = masks(n, edges, directed)
+        exact = cycles.dp(succ, pred)
+        searched = cycles.search(succ, pred, directed=directed, deadline=None)
+        assert (exact is None) == (searched is None), (n, edges)
+        for cycle in [exact, searched]:
+            if cycle is not None:
+                check(cycle, n, edges, directed)
+        found += exact is not None
+    # both outcomes come up often enough for the comparison to mean something
+    assert 30 < found < 270
+
+
+def test_petersen_has_no_cycle():
+    graph = nx.petersen_graph()
+    n = len(graph)
+    succ, pred = masks(n, graph.edges(), False)
+    assert cycles.dp(succ, pred) is None
+    assert cycles.search(succ, pred, directed=False, deadline=None) is None
+    assert cycles.hamiltonian_cycle(graph) is None
@@ -1,33 +1,180 @@
 import argparse
-import shlex
-import subprocess
+import importlib
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import traceback
+from pathlib import Path
 
 from watchfiles import watch
 
+import cache
+from all import DIAGRAMS
+
+# imported by the worker as soon as it starts, so that renders don't pay for it
+PRELOAD = ["drawsvg", "networkx", "numpy", "sympy", "diagram"]
+
+
+def mtime(mod) -> int:
+    try:
+        return os.stat(cache.source(mod)).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def serve(conn):
+    loaded = {}
+    for name in PRELOAD:
+        importlib.import_module(name)
+    for name in cache.dependencies("diagram"):
+        loaded[name] = mtime(name)
+
+    while True:
+        mod, func, out = conn.recv()
+        try:
+            # reload every local module the diagram depends on whose source
+            # changed since it was loaded, along with everything downstream
+            stale = set()
+            for m in cache.dependencies(mod):
+                t = mtime(m)
+                if m not in sys.modules:
+                    importlib.import_module(m)
+                elif loaded.get(m) != t or stale.intersection(cache.imports(m)):
+                    importlib.reload(sys.modules[m])
+                else:
+                    continue
+                loaded[m] = t
+                stale.add(m)
+            sys.modules["diagram"].save(getattr(sys.modules[mod], func)(), out)
+        except Exception:
+            conn.send(traceback.format_exc())
+        else:
+            conn.send(None)
+
+
+class Worker:
+    context = multiprocessing.get_context("spawn")
+
+    def __init__(self):
+        self.conn, child = self.context.Pipe()
+        self.process = self.context.Process(target=serve, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+
+    def stop(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def render(self, mod, func, out) -> str | None:
+        try:
+            self.conn.send((mod, func, out))
+            return self.conn.recv()
+        except (BrokenPipeError, EOFError, OSError):
+            return f"worker exited with code {self.process.exitcode}\n"
+
+
+CANCELLED = "cancelled"
+
+
+class Scheduler:
+    def __init__(self):
+        # a second worker warms up in the background so that replacing a
+        # cancelled or broken worker doesn't have to wait for its imports
+        self.worker = Worker()
+        self.spare = Worker()
+        self.cond = threading.Condition()
+        self.pending = {}
+        self.current = None
+        self.cancelled = False
+        threading.Thread(target=self.loop, daemon=True).start()
+
+    def submit(self, jobs):
+        with self.cond:
+            for job in jobs:
+                self.pending[job[0]] = job
+                if job[0] == self.current:
+                    # the in-flight render is already stale
+                    self.cancelled = True
+                    self.worker.process.kill()
+            self.cond.notify()
+
+    def replace(self):
+        self.worker.stop()
+        self.worker = self.spare
+        self.spare = Worker()
+
+    def attempt(self, job) -> str | None:
+        with self.cond:
+            self.current = job[0]
+            self.cancelled = False
+        error = self.worker.render(*job)
+        with self.cond:
+            self.current = None
+            if self.cancelled:
+                error = CANCELLED
+        if error is not None:
+            self.replace()
+        return error
+
+    def loop(self):
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+                job = self.pending.pop(next(iter(self.pending)))
+
+            print(f"rendering {job[2]}")
+            start = time.perf_counter()
+            error = self.attempt(job)
+            if error is not None and error is not CANCELLED:
+                # a reload can fail because of state left over from the
+                # previous version of the module, so retry in a fresh process
+                error = self.attempt(job)
+            if error is None:
+                print(f"rendered {job[2]} in {time.perf_counter() - start:.2f}s")
+            elif error is CANCELLED:
+                print(f"cancelled {job[2]}")
+            else:
+                print(error, end="", file=sys.stderr)
+
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("name")
+    parser.add_argument("names", nargs="*", help="diagrams to watch (default: all)")
+    parser.add_argument(
+        "--debounce",
+        type=int,
+        default=50,
+        help="milliseconds without changes before rendering",
+    )
     args = parser.parse_args()
 
-    cmd = [
-        "./diagram.py",
-        "-m",
-        args.name,
-        "-f",
-        "draw",
-        "-o",
-        f"out/{args.name}.svg",
-    ]
-
-    def run():
-        print("$", " ".join(shlex.quote(word) for word in cmd))
-        subprocess.run(cmd)
-
-    run()
-    for changes in watch(f"./{args.name}.py"):
-        print(changes)
-        run()
+    names = args.names or DIAGRAMS
+    jobs = {name: (name, "draw", f"out/{name}.svg") for name in names}
+    deps = {name: cache.dependencies(name) for name in names}
+
+    def watched(change, path) -> bool:
+        p = Path(path)
+        return p.suffix == ".py" and any(p.stem in d for d in deps.values())
+
+    scheduler = Scheduler()
+    scheduler.submit(jobs.values())
+    for changes in watch(
+        cache.ROOT, watch_filter=watched, step=args.debounce, recursive=False
+    ):
+        changed = {Path(path).stem for _, path in changes}
+        print("changed:", ", ".join(sorted(changed)))
+        affected = [name for name in names if changed.intersection(deps[name])]
+        for name in affected:
+            try:
+                deps[name] = cache.dependencies(name)
+            except (OSError, SyntaxError):
+                # keep the old graph until the file is readable again
+                pass
+        scheduler.submit(jobs[name] for name in affected)
 
 
 if __name__ == "__main__":